@@ -1,131 +1,268 @@
-import pandas as pd
+from semantic_search import TextStreamer, SimpleSemanticSearch, astream_response, stream_response
+from metrics import NULL_METRICS
+import hashlib
+from dataset_loader import iter_batches, iter_json_records
+from document_store import DocumentStore, StringColumn
+from near_duplicates import NearDuplicateIndex
 import numpy as np
-import nltk
-from nltk.corpus import stopwords
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from semantic_search import TextStreamer
-import json
 import os
 import sys
 import time
-import random
 
-class SimpleSemanticSearch:
-    def __init__(self):
-        try:
-            nltk.data.find('corpora/stopwords')
-        except LookupError:
-            nltk.download('stopwords')
-            nltk.download('punkt')
-        
-        self.vectorizer = TfidfVectorizer(
-            stop_words=stopwords.words('english'),
-            lowercase=True,
-            norm='l2'
-        )
-        
-        self.documents = []
-        self.document_vectors = None
+class AlpacaStreamingKnowledgeBase:
+    """A knowledge base assistant that streams responses with thinking steps using Alpaca dataset.
     
-    def add_documents(self, documents, ids=None):
-        if ids is None:
-            start_idx = len(self.documents)
-            ids = list(range(start_idx, start_idx + len(documents)))
-        
-        self.documents.extend(list(zip(ids, documents)))
-        
-        self._update_vectors()
+    Entries whose search text is a near-duplicate of an earlier one (MinHash
+    similarity of at least `dedupe_threshold`, see `NearDuplicateIndex`) are
+    left out of the search index, so they neither grow it nor crowd the top
+    results; `near_duplicates.members(doc_id)` maps a hit back to every
+    entry it stands for. The mapping is saved next to the index file.
+    `dedupe_threshold=None` indexes every entry. `n_jobs` tokenizes each
+    indexed chunk in that many worker processes (see `SimpleSemanticSearch`).
     
-    def _update_vectors(self):
-        texts = [doc[1] for doc in self.documents]
-        self.document_vectors = self.vectorizer.fit_transform(texts)
+    With `index_path` the entries are also saved next to the index and
+    memory-mapped on a warm start, so the dataset is not parsed again. The
+    index is reused while the dataset's size and mtime match; otherwise (or
+    always, with `verify_dataset=True`) its SHA-256 decides.
+    """
     
-    def search(self, query, top_k=5):
-        query_vector = self.vectorizer.transform([query])
-        
-        similarities = cosine_similarity(query_vector, self.document_vectors)[0]
-        
-        top_indices = np.argsort(similarities)[::-1][:top_k]
-        
-        results = []
-        for idx in top_indices:
-            doc_id, doc_text = self.documents[idx]
-            score = similarities[idx]
-            results.append((doc_id, doc_text, score))
-        
-        return results
-
-class AlpacaStreamingKnowledgeBase:
-    """A knowledge base assistant that streams responses with thinking steps using Alpaca dataset."""
+    NO_ANSWER = "I don't have enough information to answer that question accurately. Could you try rephrasing or asking something else?"
     
-    def __init__(self, alpaca_json_path, stream_speed=0.02, thinking_speed=0.003, max_entries=50000):
-        self.alpaca_data = self._load_alpaca_data(alpaca_json_path, max_entries)
-        
-        self.instructions = [entry.get("instruction", "") for entry in self.alpaca_data]
-        self.inputs = [entry.get("input", "") for entry in self.alpaca_data]
-        self.outputs = [entry["output"] for entry in self.alpaca_data]
-        
-        self.search_texts = []
-        for instruction, input_text in zip(self.instructions, self.inputs):
-            search_text = ""
-            if instruction:
-                search_text += instruction + " " + instruction
-            if input_text:
-                search_text += " " + input_text
+    def __init__(self, alpaca_json_path, stream_speed=0.02, thinking_speed=0.003, max_entries=50000, index_path=None, search_engine_cls=SimpleSemanticSearch, index_chunk_size=5000, metrics=None, dedupe_threshold=0.8, n_jobs=1, verify_dataset=False):
+        self.metrics = metrics or NULL_METRICS
+        self.dedupe_threshold = dedupe_threshold
+        self.n_jobs = n_jobs
+        self.search_engine = None
+        self.near_duplicates = None
+        dataset_info = None
+        entries = None
+        if index_path and os.path.exists(index_path):
+            print(f"Loading search index from {index_path}...")
+            self.search_engine = search_engine_cls.load(index_path)
+            stored_info = self.search_engine.metadata.get("dataset")
+            dataset_info = self._dataset_info(alpaca_json_path, max_entries, None if verify_dataset else stored_info)
+            if not self._same_dataset(stored_info, dataset_info):
+                print("Search index was built from another version of the dataset or other settings, rebuilding...")
+                self.search_engine = None
+            elif dedupe_threshold is not None:
+                self.near_duplicates = self._load_near_duplicates(index_path)
+                if self.near_duplicates is None:
+                    print("Search index was built with other near-duplicate settings, rebuilding...")
+                    self.search_engine = None
+            if self.search_engine is not None:
+                entries = self._load_entries(index_path)
+        elif index_path:
+            dataset_info = self._dataset_info(alpaca_json_path, max_entries)
+        
+        build_index = self.search_engine is None
+        if build_index:
+            self._reset_index(search_engine_cls)
+        
+        if entries is not None:
+            self.instructions = entries.fields["instruction"]
+            self.inputs = entries.fields["input"]
+            self.outputs = entries.texts
+        else:
+            # Fields are kept as UTF-8 columns read by row on demand; the search
+            # text itself lives only in the search engine's document store.
+            self.instructions = StringColumn()
+            self.inputs = StringColumn()
+            self.outputs = StringColumn()
             
-            if not search_text.strip():
-                search_text = "Empty entry"
+            # Records are parsed, validated and indexed a chunk at a time, so the
+            # raw file is never held in memory as a whole.
+            for chunk in iter_batches(self._load_alpaca_data(alpaca_json_path, max_entries), index_chunk_size):
+                start = len(self.outputs)
+                self.instructions.extend(entry["instruction"] for entry in chunk)
+                self.inputs.extend(entry["input"] for entry in chunk)
+                self.outputs.extend(entry["output"] for entry in chunk)
                 
-            self.search_texts.append(search_text)
-        
-        self.search_engine = SimpleSemanticSearch()
-        self.search_engine.add_documents(self.search_texts)
-        
+                if build_index:
+                    self._index_entries(start, [self._build_search_text(entry) for entry in chunk])
+        
+        self._print_sample_entries()
+        
+        if not build_index and not self._index_matches():
+            print("Search index does not match the dataset, rebuilding...")
+            self._reset_index(search_engine_cls)
+            for rows in iter_batches(range(len(self.outputs)), index_chunk_size):
+                self._index_entries(rows[0], [self._build_search_text(self._entry(row)) for row in rows])
+            build_index = True
+        
+        if build_index and self.near_duplicates is not None:
+            report = self.near_duplicates.report()
+            print(
+                f"Collapsed {report['removed']} near-duplicate entries into {report['clusters']} clusters "
+                f"({report['removed_ratio']:.1%} of the dataset); indexed {report['kept']} entries"
+            )
+        
+        if build_index and index_path and len(self.outputs):
+            self.search_engine.metadata["dataset"] = dataset_info
+            self.search_engine.save(index_path)
+            if self.near_duplicates is not None:
+                self.near_duplicates.save(self._near_duplicates_path(index_path))
+        if (build_index or entries is None) and index_path and len(self.outputs):
+            self._entry_store().save(self._entries_path(index_path))
+        self.search_engine.metrics = self.metrics
+        
+        self.stream_speed = stream_speed
+        self.thinking_speed = thinking_speed
         self.answer_streamer = TextStreamer(stream_interval=stream_speed)
         self.thinking_streamer = TextStreamer(stream_interval=thinking_speed)
         
         self.answer_streamer.start()
         self.thinking_streamer.start()
     
+    def _reset_index(self, search_engine_cls):
+        self.search_engine = search_engine_cls(incremental=True, n_jobs=self.n_jobs)
+        if self.dedupe_threshold is not None:
+            self.near_duplicates = NearDuplicateIndex(threshold=self.dedupe_threshold)
+    
+    def _index_entries(self, start, search_texts):
+        """Index the search texts of dataset rows `start`, `start + 1`, ..., skipping near-duplicates."""
+        if self.near_duplicates is None:
+            self.search_engine.add_documents(search_texts, ids=range(start, start + len(search_texts)))
+            return
+        rows = np.arange(start, start + len(search_texts))
+        keep = np.flatnonzero(self.near_duplicates.add(search_texts) == rows)
+        self.search_engine.add_documents([search_texts[i] for i in keep], ids=rows[keep].tolist())
+    
+    def _dataset_info(self, path, max_entries, known=None):
+        """The dataset file's size, mtime and SHA-256, and the build settings.
+        
+        The SHA-256 is taken from `known` (a previous result) when the size
+        and mtime still match it, so an unchanged file is not read.
+        """
+        stat = os.stat(path)
+        info = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "max_entries": max_entries,
+            "dedupe_threshold": self.dedupe_threshold,
+        }
+        if known and known.get("size") == stat.st_size and known.get("mtime_ns") == stat.st_mtime_ns:
+            info["sha256"] = known.get("sha256")
+        else:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            info["sha256"] = digest.hexdigest()
+        return info
+    
+    @staticmethod
+    def _same_dataset(stored_info, dataset_info):
+        # A file that was only touched keeps its content hash.
+        if not stored_info:
+            return False
+        return all(stored_info.get(key) == value for key, value in dataset_info.items() if key != "mtime_ns")
+    
+    def _index_matches(self):
+        if self.near_duplicates is None:
+            return len(self.search_engine.documents) == len(self.outputs)
+        return (
+            len(self.near_duplicates) == len(self.outputs)
+            and len(self.search_engine.documents) == self.near_duplicates.report()["kept"]
+        )
+    
+    @staticmethod
+    def _near_duplicates_path(index_path):
+        return index_path + ".dedup"
+    
+    @staticmethod
+    def _entries_path(index_path):
+        return index_path + ".entries"
+    
+    def _entry_store(self):
+        # Outputs are the store's texts; instruction and input are its fields.
+        store = DocumentStore()
+        store.texts = self.outputs
+        store.fields = {"instruction": self.instructions, "input": self.inputs}
+        return store
+    
+    def _load_entries(self, index_path):
+        path = self._entries_path(index_path)
+        if not os.path.exists(path):
+            return None
+        entries = DocumentStore.load(path)
+        if set(entries.fields) != {"instruction", "input"}:
+            return None
+        return entries
+    
+    def _load_near_duplicates(self, index_path):
+        path = self._near_duplicates_path(index_path)
+        if not os.path.exists(path):
+            return None
+        near_duplicates = NearDuplicateIndex.load(path)
+        if near_duplicates.threshold != self.dedupe_threshold:
+            return None
+        return near_duplicates
+    
     def _load_alpaca_data(self, json_path, max_entries):
+        """Yield valid entries from a JSON array or JSON Lines file, stopping at `max_entries`."""
         print(f"Loading Alpaca dataset from {json_path}...")
         
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        valid_data = []
+        loaded = 0
         skipped = 0
         
-        for entry in data:
-            if "output" in entry and entry["output"].strip():
-                if "instruction" not in entry:
-                    entry["instruction"] = ""
-                if "input" not in entry:
-                    entry["input"] = ""
-                valid_data.append(entry)
+        for entry in iter_json_records(json_path):
+            if isinstance(entry, dict) and isinstance(entry.get("output"), str) and entry["output"].strip():
+                # Missing or null fields are empty; other values are kept as text.
+                entry["instruction"] = str(entry.get("instruction") or "")
+                entry["input"] = str(entry.get("input") or "")
+                loaded += 1
+                yield entry
+                if max_entries and loaded >= max_entries:
+                    break
             else:
                 skipped += 1
         
-        if max_entries and max_entries < len(valid_data):
-            valid_data = valid_data[:max_entries]
-            
-        print(f"Loaded {len(valid_data)} valid entries from Alpaca dataset (skipped {skipped} invalid entries)")
-        
+        print(f"Loaded {loaded} valid entries from Alpaca dataset (skipped {skipped} invalid entries)")
+    
+    def _entry(self, doc_id):
+        return {
+            "instruction": self.instructions[doc_id],
+            "input": self.inputs[doc_id],
+            "output": self.outputs[doc_id],
+        }
+    
+    def _print_sample_entries(self):
         print("\nSample entries:")
-        for i in range(min(3, len(valid_data))):
+        for i in range(min(3, len(self.outputs))):
+            entry = self._entry(i)
             print(f"Entry {i+1}:")
-            print(f"  Instruction: {valid_data[i]['instruction'][:50]}...")
-            print(f"  Input: {valid_data[i]['input'][:50] if valid_data[i]['input'] else 'None'}")
-            print(f"  Output length: {len(valid_data[i]['output'])} chars")
+            print(f"  Instruction: {entry['instruction'][:50]}...")
+            print(f"  Input: {entry['input'][:50] if entry['input'] else 'None'}")
+            print(f"  Output length: {len(entry['output'])} chars")
             print()
-            
-        return valid_data
+    
+    @staticmethod
+    def _build_search_text(entry):
+        instruction = entry["instruction"]
+        input_text = entry["input"]
+        
+        search_text = ""
+        if instruction:
+            search_text += instruction + " " + instruction
+        if input_text:
+            search_text += " " + input_text
+        
+        if not search_text.strip():
+            search_text = "Empty entry"
+        
+        return search_text
     
     def _generate_thinking_steps(self, query, results):
-        thinking_steps = [
+        return self._query_thinking_steps(query) + self._result_thinking_steps(query, results)
+    
+    def _query_thinking_steps(self, query):
+        return [
             f"Analyzing query: '{query}'",
-            "Searching knowledge base...",
+            "Searching knowledge base..."
+        ]
+    
+    def _result_thinking_steps(self, query, results):
+        thinking_steps = [
             f"Found {len(results)} relevant examples",
             "Ranking results by relevance...",
             "Extracting key information...",
@@ -134,63 +271,57 @@ class AlpacaStreamingKnowledgeBase:
         
         for i, (doc_id, _, score) in enumerate(results[:3]):
             entry_desc = self._get_entry_description(doc_id)
-            thinking_steps.insert(3 + i, f"Found relevant entry: '{entry_desc}' (Relevance: {score:.2f})")
+            thinking_steps.insert(1 + i, f"Found relevant entry: '{entry_desc}' (Relevance: {score:.2f})")
         
         return thinking_steps
     
     def _get_entry_description(self, doc_id):
-        if self.instructions[doc_id]:
-            desc = self.instructions[doc_id][:50]
-            if len(self.instructions[doc_id]) > 50:
+        instruction = self.instructions[doc_id]
+        input_text = self.inputs[doc_id]
+        if instruction:
+            desc = instruction[:50]
+            if len(instruction) > 50:
                 desc += "..."
             return desc
-        elif self.inputs[doc_id]:
-            desc = self.inputs[doc_id][:50]
-            if len(self.inputs[doc_id]) > 50:
+        elif input_text:
+            desc = input_text[:50]
+            if len(input_text) > 50:
                 desc += "..."
             return f"Input: {desc}"
         else:
             return "Content entry"
     
-    def respond(self, query, show_thinking=True):
-        processed_query = query
-        
-        if query.endswith('?'):
-            processed_query = query[:-1]  
-        
-        results = self.search_engine.search(processed_query, top_k=5)
-        
-        min_score = 0.2 if len(query.split()) < 5 else 0.3
-        
-        if not results or results[0][2] < min_score:
-            response = "I don't have enough information to answer that question accurately. Could you try rephrasing or asking something else?"
-            self.answer_streamer.put(response)
-            return None
-        
-        if show_thinking:
-            thinking_steps = self._generate_thinking_steps(query, results)
-            print("\nThinking: ", end="")
+    def _candidates(self, query, thresholded=True):
+        """Hits for `query` and its relevance threshold; all hits, below it too, unless `thresholded`."""
+        with self.metrics.timer("preprocess"):
+            processed_query = query
             
-            for step in thinking_steps:
-                self.thinking_streamer.put(step + "... ")
-                self.thinking_streamer.wait_until_done()
-                time.sleep(0.2 + random.random() * 0.3)  
+            if query.endswith('?'):
+                processed_query = query[:-1]  
             
-            print("\n\nAnswer: ", end="")
+            min_score = 0.2 if len(query.split()) < 5 else 0.3
         
+        results = self.search_engine.search(processed_query, top_k=5, min_score=min_score if thresholded else None)
+        return results, min_score
+    
+    def _relevant(self, results, min_score):
+        results = [result for result in results if result[2] >= min_score]
+        return results or None
+    
+    def _retrieve(self, query):
+        candidates, min_score = self._candidates(query)
+        return self._relevant(candidates, min_score), min_score
+    
+    def _build_response(self, query, results, min_score):
         top_results = []
         for doc_id, _, score in results[:3]:
             if score >= min_score:
-                top_results.append({
-                    "instruction": self.instructions[doc_id],
-                    "input": self.inputs[doc_id],
-                    "output": self.outputs[doc_id],
-                    "score": score,
-                    "entry_type": self._determine_entry_type(doc_id)
-                })
+                entry = self._entry(doc_id)
+                entry["score"] = score
+                entry["entry_type"] = self._determine_entry_type(entry)
+                top_results.append(entry)
         
         answer = self._format_answer(query, top_results)
-        self.answer_streamer.put(answer)
         
         related_topics = []
         for result in top_results[1:3]:
@@ -201,16 +332,72 @@ class AlpacaStreamingKnowledgeBase:
                 input_snippet = result["input"][:40] + "..." if len(result["input"]) > 40 else result["input"]
                 related_topics.append(input_snippet)
         
-        return {
+        return answer, {
             "query": query,
             "answer": answer,
             "related_topics": related_topics,
             "top_score": top_results[0]["score"] if top_results else 0
         }
     
-    def _determine_entry_type(self, doc_id):
-        has_instruction = bool(self.instructions[doc_id].strip())
-        has_input = bool(self.inputs[doc_id].strip())
+    def respond(self, query, show_thinking=True, pipelined=False, cut_thinking=False):
+        """Answer `query` on the streamers; see StreamingKnowledgeBase.respond."""
+        started = time.monotonic()
+        metrics = self.metrics
+        metrics.increment("respond_queries")
+        
+        def retrieve():
+            results, min_score = self._retrieve(query)
+            return None if results is None else (results, min_score)
+        
+        with metrics.timer("respond"):
+            response_info, first_byte = stream_response(
+                self.thinking_streamer, self.answer_streamer, retrieve,
+                lambda found: self._build_response(query, *found),
+                self.NO_ANSWER,
+                query_steps=self._query_thinking_steps(query) if show_thinking else (),
+                result_steps=(lambda found: self._result_thinking_steps(query, found[0])) if show_thinking else None,
+                metrics=metrics, pipelined=pipelined, cut_thinking=cut_thinking, started=started
+            )
+            
+            if response_info is None:
+                metrics.increment("rejections")
+                return None
+            if pipelined:
+                response_info["time_to_first_answer_byte"] = first_byte
+            return response_info
+    
+    def respond_quiet(self, query):
+        """`respond` without streaming or pacing; see StreamingKnowledgeBase.respond_quiet."""
+        self.metrics.increment("respond_queries")
+        candidates, min_score = self._candidates(query, thresholded=False)
+        results = self._relevant(candidates, min_score)
+        if results is None:
+            self.metrics.increment("rejections")
+            return candidates, None
+        return results, self._build_response(query, results, min_score)[1]
+    
+    async def respond_async(self, query, show_thinking=True, paced=True, executor=None):
+        """Async version of `respond` yielding `(kind, payload)` events; see StreamingKnowledgeBase.respond_async."""
+        self.metrics.increment("respond_queries")
+        
+        def retrieve():
+            results, min_score = self._retrieve(query)
+            return None if results is None else (results, min_score)
+        
+        events = astream_response(
+            retrieve,
+            lambda found: self._build_response(query, *found),
+            self.NO_ANSWER,
+            thinking_steps=(lambda found: self._generate_thinking_steps(query, found[0])) if show_thinking else None,
+            thinking_speed=self.thinking_speed, answer_speed=self.stream_speed, paced=paced,
+            metrics=self.metrics, executor=executor
+        )
+        async for event in events:
+            yield event
+    
+    def _determine_entry_type(self, entry):
+        has_instruction = bool(entry["instruction"].strip())
+        has_input = bool(entry["input"].strip())
         
         if has_instruction and not has_input:
             return "question_answer"  
@@ -255,15 +442,18 @@ class AlpacaStreamingKnowledgeBase:
     def close(self):
         self.answer_streamer.stop()
         self.thinking_streamer.stop()
+        self.search_engine.close()
 
 
 if __name__ == "__main__":
     alpaca_json_path = "alpaca_data_cleaned.json"  
+    index_path = "alpaca_data_cleaned.ssidx"
     
     print("Streaming Knowledge Base Assistant")
     print("----------------------------------------")
     print("Type 'quit' to exit")
     print("Type 'fast' to toggle thinking steps")
+    print("Type 'pipeline' to toggle preparing the answer while thinking")
     print()
     
     if not os.path.exists(alpaca_json_path):
@@ -271,9 +461,10 @@ if __name__ == "__main__":
         print("Please download the dataset and update the path.")
         sys.exit(1)
     
-    assistant = AlpacaStreamingKnowledgeBase(alpaca_json_path)
+    assistant = AlpacaStreamingKnowledgeBase(alpaca_json_path, index_path=index_path)
     
     show_thinking = True
+    pipelined = False
     
     try:
         while True:
@@ -288,7 +479,12 @@ if __name__ == "__main__":
                 print(f"\nThinking steps {'enabled' if show_thinking else 'disabled'}")
                 continue
             
-            response_info = assistant.respond(query, show_thinking=show_thinking)
+            if query.lower() == "pipeline":
+                pipelined = not pipelined
+                print(f"\nPipelined answers {'enabled' if pipelined else 'disabled'}")
+                continue
+            
+            response_info = assistant.respond(query, show_thinking=show_thinking, pipelined=pipelined)
             
             assistant.answer_streamer.wait_until_done()
             
@@ -0,0 +1,255 @@
+import time
+
+import numpy as np
+
+from dense_index import DenseSemanticSearch
+from semantic_search import SimpleSemanticSearch
+
+
+class IVFSemanticSearch(DenseSemanticSearch):
+    """DenseSemanticSearch with an inverted-file (IVF) approximate index.
+
+    The normalized LSA vectors are clustered with k-means into `n_lists`
+    coarse lists (default about `4 * sqrt(n_documents)`), and `dense_vectors`
+    is stored grouped by list so every list is one contiguous block. A query
+    is compared with the list centroids first and only the `nprobe` closest
+    lists are scored, which trades a little recall for skipping most of the
+    corpus; `recall_report` measures that trade-off against brute force.
+
+    With `rerank=True` the best `rerank_depth` candidates (default
+    `10 * top_k`) are re-scored exactly against the sparse TF-IDF rows, so
+    the returned scores are ordinary TF-IDF cosine similarities and
+    `min_score` thresholds keep their meaning.
+
+    Rows come back padded with index -1 and score -inf when the probed lists
+    hold fewer than `top_k` documents. Clusters are fitted and saved with the
+    projection; rows added later join the end of the list of their nearest
+    centroid until a compaction or `refit_projection` re-clusters.
+
+    A `filter` that matches fewer documents than the probed lists hold on
+    average is answered exactly over just those documents; a broader one
+    keeps the matching candidates of the probed lists.
+    """
+
+    def __init__(self, *args, n_lists=None, nprobe=8, rerank=False, rerank_depth=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.rerank_depth = rerank_depth
+        self.centroids = None
+        self.list_rows = None
+        self.list_offsets = None
+        self.list_positions = None
+
+    def _fit_projection(self, vectors, vocabulary):
+        from sklearn.cluster import MiniBatchKMeans
+
+        projection = super()._fit_projection(vectors, vocabulary)
+        dense = projection["dense_vectors"]
+        n_rows = dense.shape[0]
+        n_lists = self.n_lists or int(4 * np.sqrt(n_rows))
+        n_lists = max(1, min(n_lists, n_rows))
+
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_lists, random_state=0, n_init=3, batch_size=max(1024, 4 * n_lists)
+        )
+        labels = kmeans.fit_predict(dense.astype(np.float32))
+
+        order = np.argsort(labels, kind='stable')
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=list_offsets[1:])
+        projection.update({
+            "dense_vectors": np.ascontiguousarray(dense[order]),
+            "centroids": self._normalize(kmeans.cluster_centers_.astype(np.float32)),
+            "list_rows": order,
+            "list_offsets": list_offsets,
+        })
+        return projection
+
+    def _set_projection(self, projection):
+        super()._set_projection(projection)
+        self.centroids = projection["centroids"]
+        self._set_list_rows(projection["list_rows"])
+        self.list_offsets = projection["list_offsets"]
+
+    def _append_projected(self, dense):
+        # Each new row goes at the end of its nearest centroid's list.
+        labels = np.argmax(dense @ self.centroids.T, axis=1)
+        positions = self.list_offsets[labels + 1]
+        rows = np.arange(self._projected_rows, self._projected_rows + len(dense))
+        self.dense_vectors = np.insert(self.dense_vectors, positions, dense.astype(self.dtype), axis=0)
+        self._set_list_rows(np.insert(self.list_rows, positions, rows))
+        counts = np.bincount(labels, minlength=len(self.centroids))
+        self.list_offsets = self.list_offsets + np.concatenate([[0], np.cumsum(counts)])
+
+    def _set_list_rows(self, list_rows):
+        self.list_rows = list_rows
+        self.list_positions = np.empty_like(list_rows)
+        self.list_positions[list_rows] = np.arange(len(list_rows))
+
+    def _score(self, query_vectors):
+        # Brute-force scores over every row, returned in document order.
+        list_scores = super()._score(query_vectors)
+        scores = np.empty_like(list_scores)
+        scores[:, self.list_rows] = list_scores
+        return scores
+
+    def _score_rows(self, query_vectors, rows):
+        # Filtered searches that skip probing score their rows exactly, as
+        # the probed search would have (sparse with rerank, dense otherwise).
+        if self.rerank:
+            return SimpleSemanticSearch._score_rows(self, query_vectors, rows)
+        self._ensure_projected()
+        return self._dense_scores(self._project_queries(query_vectors), self.dense_vectors[self.list_positions[rows]])
+
+    def _gather_rows(self, rows, n_documents):
+        return True
+
+    def _rank_batches(self, query_vectors, rows, k, batch_size, indices, scores):
+        n_documents = self.document_vectors.shape[0]
+        self._ensure_projected()
+        nprobe = max(1, min(self.nprobe, len(self.centroids)))
+        depth = max(k, self.rerank_depth or 10 * k)
+
+        allowed = None
+        if rows is not None:
+            if len(rows) <= nprobe * n_documents / len(self.centroids):
+                # Fewer documents match than a probe would scan: score them all.
+                SimpleSemanticSearch._rank_batches(self, query_vectors, rows, k, batch_size, indices, scores)
+                return
+            allowed = np.zeros(n_documents, dtype=bool)
+            allowed[rows] = True
+        elif len(self._deleted_rows):
+            allowed = ~self._tombstones
+
+        metrics = self.metrics
+        for start in range(0, query_vectors.shape[0], batch_size):
+            batch = query_vectors[start:start + batch_size]
+            projected = self._project_queries(batch)
+            with metrics.timer("probe"):
+                probes, _ = self._select_top_k(projected @ self.centroids.T, nprobe)
+
+            for row in range(batch.shape[0]):
+                with metrics.timer("similarity"):
+                    positions, candidate_scores = self._scan_lists(projected[row], probes[row])
+                if allowed is not None:
+                    live = allowed[self.list_rows[positions]]
+                    positions = positions[live]
+                    candidate_scores = candidate_scores[live]
+                if not len(positions):
+                    continue
+                with metrics.timer("rank"):
+                    top, top_scores = self._select_top_k(
+                        candidate_scores[None], min(depth if self.rerank else k, len(positions))
+                    )
+                    rows = self.list_rows[positions[top[0]]]
+                    top_scores = top_scores[0]
+                if self.rerank:
+                    with metrics.timer("rerank"):
+                        exact = (self.document_vectors[rows] @ batch[row].T).toarray().ravel()
+                        top, top_scores = self._select_top_k(exact[None], min(k, len(rows)))
+                        rows = rows[top[0]]
+                        top_scores = top_scores[0]
+                indices[start + row, :len(rows)] = rows
+                scores[start + row, :len(rows)] = top_scores
+
+    def _scan_lists(self, query, lists):
+        """Score `query` against the given lists; returns list-order positions and scores."""
+        positions = []
+        list_scores = []
+        for list_id in lists:
+            begin, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if begin == end:
+                continue
+            positions.append(np.arange(begin, end))
+            list_scores.append(self._dense_scores(query[None], self.dense_vectors[begin:end])[0])
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(positions), np.concatenate(list_scores)
+
+    def _brute_force(self, queries, k, batch_size=256):
+        query_vectors = self.transform(queries)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), batch_size):
+            batch = query_vectors[start:start + batch_size]
+            if self.rerank:
+                batch_scores = SimpleSemanticSearch._score(self, batch)
+            else:
+                batch_scores = self._score(batch)
+            self._mask_deleted(batch_scores)
+            indices[start:start + batch_size] = self._select_top_k(batch_scores, k)[0]
+        return indices
+
+    def recall_report(self, queries, top_k=10, nprobes=(1, 2, 4, 8, 16, 32), batch_size=256):
+        """Recall@`top_k` and latency for each `nprobe`, against brute force.
+
+        Ground truth is exact TF-IDF ranking when `rerank` is on and exact
+        dense ranking otherwise, i.e. whatever the approximate search is
+        trying to reproduce. Returns a dict with the brute-force latency and
+        one entry per `nprobe` value.
+        """
+        self._sync_vectors()
+        self._ensure_projected()
+        k = min(top_k, self.document_vectors.shape[0])
+
+        start = time.perf_counter()
+        truth = self._brute_force(queries, k, batch_size)
+        brute_force_seconds = time.perf_counter() - start
+        truth_sets = [set(row) for row in truth.tolist()]
+
+        saved_nprobe = self.nprobe
+        rows = []
+        try:
+            for nprobe in nprobes:
+                self.nprobe = nprobe
+                start = time.perf_counter()
+                indices, _ = self.search_batch(queries, top_k=k, batch_size=batch_size)
+                seconds = time.perf_counter() - start
+                hits = sum(len(expected.intersection(found)) for expected, found in zip(truth_sets, indices.tolist()))
+                rows.append({
+                    "nprobe": nprobe,
+                    "recall": hits / max(1, k * len(queries)),
+                    "ms_per_query": seconds * 1000 / max(1, len(queries)),
+                })
+        finally:
+            self.nprobe = saved_nprobe
+
+        return {
+            "top_k": k,
+            "n_lists": len(self.centroids),
+            "rerank": self.rerank,
+            "brute_force_ms_per_query": brute_force_seconds * 1000 / max(1, len(queries)),
+            "nprobe": rows,
+        }
+
+    def memory_usage(self):
+        usage = super().memory_usage()
+        if self.centroids is not None:
+            usage["ivf_bytes"] = (
+                self.centroids.nbytes + self.list_rows.nbytes + self.list_offsets.nbytes + self.list_positions.nbytes
+            )
+        return usage
+
+    def _save_extra(self, arrays, meta):
+        super()._save_extra(arrays, meta)
+        arrays["ivf_centroids"] = self.centroids
+        arrays["ivf_list_rows"] = self.list_rows
+        arrays["ivf_list_offsets"] = self.list_offsets
+        meta["ivf_n_lists"] = self.n_lists
+
+    def _load_extra(self, meta, arrays):
+        SimpleSemanticSearch._load_extra(self, meta, arrays)
+        # Only reuse vectors that are grouped for these lists; otherwise refit lazily.
+        if not self._saved_projection_usable(meta, arrays):
+            return
+        if "ivf_centroids" not in arrays or meta.get("ivf_n_lists") != self.n_lists:
+            return
+        self.components = np.asarray(arrays["dense_components"])
+        self._components_vocabulary = self.vocabulary
+        self.dense_vectors = arrays["dense_vectors"]
+        self.centroids = np.asarray(arrays["ivf_centroids"])
+        self._set_list_rows(np.asarray(arrays["ivf_list_rows"]))
+        self.list_offsets = np.asarray(arrays["ivf_list_offsets"])
+        self._projected_rows = self.dense_vectors.shape[0]
+        self._projected_vectors = self.document_vectors
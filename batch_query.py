@@ -0,0 +1,180 @@
+import argparse
+import contextlib
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from dataset_loader import iter_batches
+from search_server import MicroBatcher
+
+
+def iter_queries(lines):
+    """Yield `(query_id, query)` from plain-text lines or JSON lines with a "query" (and optional "id").
+
+    Blank lines are skipped; plain-text queries are numbered by line.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            record = json.loads(line)
+            yield record.get("id", number), record["query"]
+        else:
+            yield number, line
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def load_assistant(kind, path, index_path=None):
+    """Build an assistant of `kind` ("faq", "knowledge" or "alpaca") from the data file at `path`."""
+    # Assistants report loading progress on stdout, which may carry our output.
+    with contextlib.redirect_stdout(sys.stderr):
+        if kind == "alpaca":
+            from alpaca_search import AlpacaStreamingKnowledgeBase
+            return AlpacaStreamingKnowledgeBase(path, index_path=index_path)
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if kind == "knowledge":
+            from search_applied import StreamingKnowledgeBase
+            return StreamingKnowledgeBase(data)
+        if kind == "faq":
+            from semantic_search import StreamingFAQChatbot
+            return StreamingFAQChatbot(data)
+    raise ValueError(f"unknown assistant kind {kind!r}")
+
+
+class BatchRunner:
+    """Answers queries without streaming, `threads` at a time.
+
+    The assistant's search engine is wrapped in a `MicroBatcher`, so the
+    concurrent `respond_quiet` calls are scored in shared batches. A query
+    that nothing answers is written with `"rejected": true`, its matches
+    being the hits that fell below the assistant's threshold.
+    """
+
+    def __init__(self, assistant, threads=32, max_batch=32):
+        self.assistant = assistant
+        assistant.search_engine = MicroBatcher(assistant.search_engine, max_batch=max_batch, window=0.002)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def _answer(self, item):
+        query_id, query = item
+        results, info = self.assistant.respond_quiet(query)
+        record = {
+            "id": query_id,
+            "query": query,
+            "matches": [{"id": doc_id, "score": score} for doc_id, _, score in results],
+            "rejected": info is None,
+            "response": info,
+        }
+        return json.dumps(record, default=_json_default)
+
+    def run_chunk(self, chunk):
+        """JSON lines for `chunk`, a list of `(query_id, query)`, in input order."""
+        return list(self.executor.map(self._answer, chunk))
+
+    def close(self):
+        self.executor.shutdown()
+        self.assistant.close()
+
+
+_runner = None
+
+
+def _init_worker(kind, path, index_path, threads):
+    global _runner
+    _runner = BatchRunner(load_assistant(kind, path, index_path), threads=threads)
+
+
+def _run_chunk(chunk):
+    return _runner.run_chunk(chunk)
+
+
+def run_batch(kind, path, queries, output, index_path=None, jobs=1, chunk_size=256, threads=32, progress_interval=5.0):
+    """Answer every `(query_id, query)` in `queries`, writing one JSON line each to `output` in input order.
+
+    With `jobs > 1` chunks are spread over that many processes, each with
+    its own copy of the assistant (a saved Alpaca index is memory-mapped,
+    so it is shared). Progress goes to stderr every `progress_interval`
+    seconds. Returns `(count, seconds)`.
+    """
+    start = time.perf_counter()
+    count = 0
+    last_report = start
+
+    def write(lines):
+        nonlocal count, last_report
+        for line in lines:
+            output.write(line + "\n")
+        count += len(lines)
+        now = time.perf_counter()
+        if now - last_report >= progress_interval:
+            last_report = now
+            print(f"{count} queries answered, {count / (now - start):.0f} queries/s", file=sys.stderr)
+
+    if jobs == 1:
+        runner = BatchRunner(load_assistant(kind, path, index_path), threads=threads)
+        try:
+            for chunk in iter_batches(queries, chunk_size):
+                write(runner.run_chunk(chunk))
+        finally:
+            runner.close()
+    else:
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(kind, path, index_path, threads)
+        ) as executor:
+            # Keep a bounded number of chunks in flight so stdin is read as we go.
+            pending = deque()
+            for chunk in iter_batches(queries, chunk_size):
+                pending.append(executor.submit(_run_chunk, chunk))
+                if len(pending) >= 2 * jobs:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+
+    output.flush()
+    seconds = time.perf_counter() - start
+    return count, seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a file of queries and write the results as JSON lines.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--faq", help="JSON list of {question, answer} entries")
+    source.add_argument("--knowledge", help="JSON list of {title, content, category} entries")
+    source.add_argument("--alpaca", help="Alpaca dataset (JSON array or JSON Lines)")
+    parser.add_argument("--index", help="index file to load or create (Alpaca only)")
+    parser.add_argument("--queries", default="-", help="one query per line, or JSON lines with a 'query' field ('-' for stdin)")
+    parser.add_argument("--output", default="-", help="JSON lines output ('-' for stdout)")
+    parser.add_argument("--jobs", type=int, default=1, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=32, help="concurrent queries per process")
+    args = parser.parse_args()
+
+    kind, path = next((k, getattr(args, k)) for k in ("faq", "knowledge", "alpaca") if getattr(args, k))
+
+    with contextlib.ExitStack() as stack:
+        if args.queries == "-":
+            query_lines = sys.stdin
+        else:
+            query_lines = stack.enter_context(open(args.queries, 'r', encoding='utf-8'))
+        if args.output == "-":
+            output = sys.stdout
+        else:
+            output = stack.enter_context(open(args.output, 'w', encoding='utf-8'))
+
+        count, seconds = run_batch(
+            kind, path, iter_queries(query_lines), output, index_path=args.index,
+            jobs=args.jobs, chunk_size=args.chunk_size, threads=args.threads
+        )
+
+    print(f"Answered {count} queries in {seconds:.1f}s ({count / max(seconds, 1e-9):.0f} queries/s)", file=sys.stderr)
@@ -0,0 +1,346 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+_SYLLABLES = [c + v for c in "bdfghklmnprstvz" for v in "aeiou"]
+
+
+def synthetic_vocabulary(size):
+    """Deterministic pronounceable pseudo-words (`baba`, `babe`, ...), none of them stop words."""
+    words = []
+    base = len(_SYLLABLES)
+    for i in range(size):
+        syllables = []
+        n = i
+        for _ in range(2):
+            syllables.append(_SYLLABLES[n % base])
+            n //= base
+        while n:
+            syllables.append(_SYLLABLES[n % base])
+            n //= base
+        words.append("".join(syllables))
+    return words
+
+
+def generate_corpus(n_docs, seed=0, vocab_size=None, min_length=8, max_length=40, zipf_exponent=1.1, block_size=10000):
+    """Yield `n_docs` synthetic documents with Zipf-distributed word frequencies.
+
+    The vocabulary grows with the corpus (`vocab_size` defaults to roughly
+    `20 * sqrt(n_docs)`), as real corpora do. Output depends only on the
+    arguments, so runs on different commits see the same text.
+    """
+    rng = np.random.default_rng(seed)
+    if vocab_size is None:
+        vocab_size = max(1000, int(20 * np.sqrt(n_docs)))
+    vocabulary = np.array(synthetic_vocabulary(vocab_size), dtype=object)
+    weights = 1.0 / np.arange(1, vocab_size + 1) ** zipf_exponent
+    weights /= weights.sum()
+    # Shuffle which words are frequent so frequency is not tied to word length.
+    vocabulary = vocabulary[rng.permutation(vocab_size)]
+
+    for start in range(0, n_docs, block_size):
+        count = min(block_size, n_docs - start)
+        lengths = rng.integers(min_length, max_length + 1, size=count)
+        words = vocabulary[rng.choice(vocab_size, size=lengths.sum(), p=weights)]
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        for i in range(count):
+            yield " ".join(words[bounds[i]:bounds[i + 1]])
+
+
+def generate_queries(documents, n_queries, seed=1, min_terms=2, max_terms=5):
+    """Sample queries as short word subsets of random documents, so each query has matches."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for doc_index in rng.integers(0, len(documents), size=n_queries):
+        words = documents[doc_index].split()
+        n_terms = min(len(words), int(rng.integers(min_terms, max_terms + 1)))
+        picked = rng.choice(len(words), size=n_terms, replace=False)
+        queries.append(" ".join(words[i] for i in sorted(picked)))
+    return queries
+
+
+def _percentiles(samples):
+    samples = np.asarray(samples) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+    }
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _engine_class(name):
+    if name == "simple":
+        from semantic_search import SimpleSemanticSearch
+        return SimpleSemanticSearch
+    if name == "inverted":
+        from inverted_index import InvertedIndexSearch
+        return InvertedIndexSearch
+    if name == "sharded":
+        from sharded_search import ShardedSemanticSearch
+        return ShardedSemanticSearch
+    if name == "dense":
+        from dense_index import DenseSemanticSearch
+        return DenseSemanticSearch
+    if name == "ivf":
+        from ann_index import IVFSemanticSearch
+        return IVFSemanticSearch
+    if name == "quantized":
+        from quantized_index import QuantizedSemanticSearch
+        return QuantizedSemanticSearch
+    if name == "two-stage":
+        from rerank import TwoStageSemanticSearch
+        return TwoStageSemanticSearch
+    raise ValueError(f"unknown engine {name!r}")
+
+
+def benchmark_size(n_docs, engine="simple", n_queries=1000, batch_size=256, top_k=5, seed=0):
+    """Build an index over `n_docs` synthetic documents and time queries against it."""
+    documents = list(generate_corpus(n_docs, seed=seed))
+    queries = generate_queries(documents, n_queries, seed=seed + 1)
+    rss_before = _peak_rss_bytes()
+
+    search_engine = _engine_class(engine)()
+    start = time.perf_counter()
+    search_engine.add_documents(documents)
+    search_engine.search(queries[0], top_k=top_k)
+    build_seconds = time.perf_counter() - start
+
+    vectors = search_engine.document_vectors
+    memory = search_engine.memory_usage()
+
+    single = []
+    for query in queries:
+        start = time.perf_counter()
+        search_engine.search(query, top_k=top_k)
+        single.append(time.perf_counter() - start)
+
+    batches = []
+    for offset in range(0, len(queries), batch_size):
+        chunk = queries[offset:offset + batch_size]
+        start = time.perf_counter()
+        search_engine.search_batch(chunk, top_k=top_k)
+        batches.append(time.perf_counter() - start)
+
+    recall = None
+    if hasattr(search_engine, "recall_report"):
+        recall = search_engine.recall_report(queries, top_k=top_k)
+    rerank = None
+    if hasattr(search_engine, "rerank_report"):
+        rerank = search_engine.rerank_report(queries, top_k=top_k)
+
+    search_engine.close()
+
+    result = {
+        "engine": engine,
+        "n_docs": n_docs,
+        "n_terms": int(vectors.shape[1]),
+        "nnz": int(vectors.nnz),
+        "build_seconds": build_seconds,
+        "matrix_bytes": int(memory["sparse_matrix_bytes"]),
+        "index_bytes": {name: int(size) for name, size in memory.items()},
+        "peak_rss_bytes": int(_peak_rss_bytes()),
+        "build_rss_growth_bytes": int(_peak_rss_bytes() - rss_before),
+        "single_query": dict(_percentiles(single), queries=len(single)),
+        "batch_query": dict(
+            _percentiles(batches),
+            batch_size=batch_size,
+            queries_per_second=len(queries) / sum(batches),
+        ),
+    }
+    if recall is not None:
+        result["recall"] = recall
+    if rerank is not None:
+        result["rerank"] = rerank
+    return result
+
+
+# Modules too slow to import on the load-and-query path.
+HEAVY_MODULES = ("sklearn", "nltk", "pandas")
+
+_COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from semantic_search import SimpleSemanticSearch
+imported = time.perf_counter()
+engine = SimpleSemanticSearch.load(sys.argv[1])
+loaded = time.perf_counter()
+engine.search(sys.argv[2])
+searched = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "load_seconds": loaded - imported,
+    "first_query_seconds": searched - loaded,
+    "total_seconds": searched - start,
+    "heavy_modules": [name for name in sys.argv[3:] if name in sys.modules],
+}))
+"""
+
+
+def cold_start(n_docs=10000, seed=0, repeats=3):
+    """Time import, index load and first query in fresh interpreters; best of `repeats`.
+
+    Also lists which of `HEAVY_MODULES` ended up imported, which should be none.
+    """
+    from semantic_search import SimpleSemanticSearch
+
+    documents = list(generate_corpus(n_docs, seed=seed))
+    query = generate_queries(documents, 1, seed=seed + 1)[0]
+    search_engine = SimpleSemanticSearch()
+    search_engine.add_documents(documents)
+
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cold_start.ssidx")
+        search_engine.save(path)
+        for _ in range(repeats):
+            output = subprocess.run(
+                [sys.executable, "-c", _COLD_START_SCRIPT, path, query, *HEAVY_MODULES],
+                capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout
+            runs.append(json.loads(output))
+
+    best = min(runs, key=lambda r: r["total_seconds"])
+    return dict(best, n_docs=n_docs, repeats=repeats)
+
+
+def check_startup(report, budget):
+    """Return human-readable violations of the cold start `budget` (seconds) in `report`."""
+    startup = report["cold_start"]
+    violations = []
+    if startup["total_seconds"] > budget:
+        violations.append(
+            f"cold start took {startup['total_seconds']:.3f}s, budget {budget:.3f}s "
+            f"(import {startup['import_seconds']:.3f}s, load {startup['load_seconds']:.3f}s, "
+            f"first query {startup['first_query_seconds']:.3f}s)"
+        )
+    if startup["heavy_modules"]:
+        violations.append(f"cold start imported {', '.join(startup['heavy_modules'])}")
+    return violations
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, **kwargs):
+    """Benchmark each size in a fresh process so peak RSS is per size."""
+    import numpy
+    import sklearn
+
+    results = []
+    for n_docs in sizes:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results.append(executor.submit(benchmark_size, n_docs, **kwargs).result())
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        startup = executor.submit(cold_start, seed=kwargs.get("seed", 0)).result()
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "sklearn": sklearn.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "settings": kwargs,
+        },
+        "results": results,
+        "cold_start": startup,
+    }
+
+
+_LOWER_IS_BETTER = [
+    ("build_seconds",),
+    ("matrix_bytes",),
+    ("peak_rss_bytes",),
+    ("single_query", "p50_ms"),
+    ("single_query", "p99_ms"),
+    ("batch_query", "p50_ms"),
+]
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Return human-readable regressions of `report` against `baseline` beyond `tolerance`."""
+    previous = {(r["engine"], r["n_docs"]): r for r in baseline["results"]}
+    regressions = []
+    if "cold_start" in report and "cold_start" in baseline:
+        new, old = report["cold_start"]["total_seconds"], baseline["cold_start"]["total_seconds"]
+        if old and new > old * (1 + tolerance):
+            regressions.append(f"cold_start.total_seconds: {old:.4g} -> {new:.4g} (+{(new / old - 1) * 100:.0f}%)")
+    for result in report["results"]:
+        before = previous.get((result["engine"], result["n_docs"]))
+        if before is None:
+            continue
+        for path in _LOWER_IS_BETTER:
+            new, old = result, before
+            for key in path:
+                new, old = new[key], old[key]
+            if old and new > old * (1 + tolerance):
+                regressions.append(
+                    f"{result['engine']} n_docs={result['n_docs']} {'.'.join(path)}: "
+                    f"{old:.4g} -> {new:.4g} (+{(new / old - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SimpleSemanticSearch on synthetic corpora.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--engine", choices=["simple", "inverted", "sharded", "dense", "ivf", "quantized", "two-stage"], default="simple")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--startup-budget", type=float,
+                        help="fail if import + index load + first query takes longer (seconds)")
+    args = parser.parse_args()
+
+    report = run(
+        args.sizes, engine=args.engine, n_queries=args.queries,
+        batch_size=args.batch_size, top_k=args.top_k, seed=args.seed
+    )
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    failures = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            failures += [f"REGRESSION {line}" for line in compare(report, json.load(f), args.tolerance)]
+    if args.startup_budget is not None:
+        failures += [f"BUDGET {line}" for line in check_startup(report, args.startup_budget)]
+    for line in failures:
+        print(line, file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,91 @@
+import json
+
+_WHITESPACE = " \t\r\n"
+
+
+def iter_json_records(path, chunk_size=1 << 16):
+    """Yield records one at a time from a JSON array file or a JSON Lines file.
+
+    A file whose first non-whitespace character is `[` is parsed as a single
+    top-level array, `chunk_size` characters at a time, so only the record
+    being decoded is held in memory. Anything else is read as JSON Lines.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.read(chunk_size)
+        stripped = first.lstrip(_WHITESPACE)
+        if stripped.startswith("["):
+            yield from _iter_array(f, stripped[1:], chunk_size)
+            return
+
+        f.seek(0)
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON line ({e.msg})") from None
+
+
+def _iter_array(f, buffer, chunk_size):
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    expect_value = True
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of file inside JSON array")
+            buffer = f.read(chunk_size)
+            pos = 0
+            eof = not buffer
+            continue
+
+        char = buffer[pos]
+        if char == "]":
+            return
+        if not expect_value:
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON array, found {char!r}")
+            pos += 1
+            expect_value = True
+            continue
+
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+            complete = eof or end < len(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+
+        if not complete:
+            # The record may be cut off by the end of the buffer; read more.
+            more = f.read(chunk_size)
+            eof = not more
+            buffer = buffer[pos:] + more
+            pos = 0
+            continue
+
+        yield record
+        pos = end
+        expect_value = False
+        if pos > chunk_size:
+            buffer = buffer[pos:]
+            pos = 0
+
+
+def iter_batches(iterable, batch_size):
+    """Group an iterable into lists of at most `batch_size` items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
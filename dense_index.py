@@ -0,0 +1,191 @@
+import numpy as np
+
+from semantic_search import SimpleSemanticSearch
+
+
+class DenseSemanticSearch(SimpleSemanticSearch):
+    """SimpleSemanticSearch that ranks in a dense LSA space.
+
+    The TF-IDF matrix is projected to `n_components` dimensions with
+    `TruncatedSVD`, and the L2-normalized projections are stored as one
+    C-ordered array of `dtype` (float32, or float16 to halve memory). A batch
+    of queries is projected the same way and scored with a single BLAS
+    matrix product; float16 rows are widened to float32 `block_size` rows at
+    a time, since BLAS has no half-precision kernels. `save` stores the
+    projection with the index so `load` does not have to refit.
+
+    The projection is fitted on the first search. Rows added or updated
+    later are projected with the fitted components, and existing rows keep
+    their projections when IDF weights change; the projection is only
+    refitted by a compaction or `refit_projection`, both without holding
+    `lock` during the fit.
+
+    Scores are cosine similarities in the latent space, so documents that
+    share no terms with the query can still match through co-occurring
+    vocabulary; they are not directly comparable with sparse TF-IDF scores.
+    """
+
+    def __init__(self, *args, n_components=256, dtype=np.float32, block_size=65536, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_components = n_components
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float16):
+            raise ValueError("dtype must be float32 or float16")
+        self.block_size = block_size
+        self.svd = None
+        self.components = None
+        self.dense_vectors = None
+        # The vocabulary the columns of `components` follow, how many rows
+        # `dense_vectors` holds and the matrix they were last synced with.
+        self._components_vocabulary = None
+        self._projected_rows = 0
+        self._projected_vectors = None
+
+    def _fit_projection(self, vectors, vocabulary):
+        """Fit the projection of `vectors`, whose columns follow `vocabulary`; touches no engine state."""
+        from sklearn.decomposition import TruncatedSVD
+
+        n_components = max(1, min(self.n_components, vectors.shape[1] - 1, vectors.shape[0]))
+        svd = TruncatedSVD(n_components=n_components, random_state=0)
+        dense = svd.fit_transform(vectors).astype(np.float32)
+        return {
+            "svd": svd,
+            "components": svd.components_.astype(np.float32),
+            "vocabulary": vocabulary,
+            "dense_vectors": np.ascontiguousarray(self._normalize(dense), dtype=self.dtype),
+        }
+
+    def _set_projection(self, projection):
+        self.svd = projection["svd"]
+        self.components = projection["components"]
+        self._components_vocabulary = projection["vocabulary"]
+        self.dense_vectors = projection["dense_vectors"]
+        self._projected_rows = self.dense_vectors.shape[0]
+        self._projected_vectors = None
+
+    def _ensure_projected(self):
+        if self._projected_vectors is self.document_vectors:
+            return
+        if self.components is None:
+            self._set_projection(self._fit_projection(self.document_vectors, self.vocabulary))
+        else:
+            self._align_components()
+            new_rows = self.document_vectors[self._projected_rows:]
+            if new_rows.shape[0]:
+                self._append_projected(self._project_queries(new_rows))
+        self._projected_rows = self.document_vectors.shape[0]
+        self._projected_vectors = self.document_vectors
+
+    def _align_components(self):
+        # Give `components` a column per term of the current vocabulary;
+        # terms added since the fit get zero weight.
+        vocabulary = self.vocabulary
+        fitted = self._components_vocabulary
+        if vocabulary is fitted and self.components.shape[1] == len(vocabulary):
+            return
+        components = np.zeros((self.components.shape[0], len(vocabulary)), dtype=np.float32)
+        if vocabulary is fitted:
+            # An incremental vocabulary only grows, keeping its columns.
+            components[:, :self.components.shape[1]] = self.components
+        else:
+            columns = [(column, vocabulary[term]) for term, column in fitted.items() if term in vocabulary]
+            if columns:
+                old, new = np.array(columns, dtype=np.int64).T
+                components[:, new] = self.components[:, old]
+        self.components = components
+        self._components_vocabulary = vocabulary
+
+    def _append_projected(self, dense):
+        """Append the normalized projections of the rows after `_projected_rows`."""
+        self.dense_vectors = np.concatenate([self.dense_vectors, dense.astype(self.dtype)])
+
+    def refit_projection(self):
+        """Refit the projection on the current rows, holding `lock` only to take and swap them."""
+        with self.lock:
+            self._sync_vectors()
+            if self.document_vectors is None:
+                return
+            documents = self.documents
+            vectors = self.document_vectors
+            vocabulary = self.vocabulary
+        projection = self._fit_projection(vectors, vocabulary)
+        with self.lock:
+            # A compaction renumbered the rows meanwhile (and refitted).
+            if self.documents is documents:
+                self._set_projection(projection)
+
+    def _rebuild_extra(self, vectors, vocabulary):
+        return self._fit_projection(vectors, vocabulary)
+
+    def _swap_extra(self, extra):
+        super()._swap_extra(extra)
+        if extra is None:
+            self.components = None
+            self._projected_vectors = None
+        else:
+            self._set_projection(extra)
+
+    def _project_queries(self, query_vectors):
+        return self._normalize(np.asarray(query_vectors @ self.components.T, dtype=np.float32))
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def _score(self, query_vectors):
+        self._ensure_projected()
+        return self._dense_scores(self._project_queries(query_vectors), self.dense_vectors)
+
+    def _score_rows(self, query_vectors, rows):
+        self._ensure_projected()
+        return self._dense_scores(self._project_queries(query_vectors), self.dense_vectors[rows])
+
+    def _dense_scores(self, queries, vectors):
+        if self.dtype == np.float32:
+            return queries @ vectors.T
+
+        scores = np.empty((queries.shape[0], vectors.shape[0]), dtype=np.float32)
+        for start in range(0, vectors.shape[0], self.block_size):
+            block = vectors[start:start + self.block_size].astype(np.float32)
+            scores[:, start:start + self.block_size] = queries @ block.T
+        return scores
+
+    def memory_usage(self):
+        with self.lock:
+            usage = super().memory_usage()
+            if self.document_vectors is not None:
+                self._ensure_projected()
+                usage["dense_matrix_bytes"] = self.dense_vectors.nbytes
+                usage["projection_bytes"] = self.components.nbytes
+            return usage
+
+    def _save_extra(self, arrays, meta):
+        super()._save_extra(arrays, meta)
+        self._ensure_projected()
+        arrays["dense_components"] = self.components
+        arrays["dense_vectors"] = self.dense_vectors
+        meta["dense_n_components"] = self.n_components
+
+    def _saved_projection_usable(self, meta, arrays):
+        # A projection saved with other settings is ignored and refitted lazily.
+        return (
+            meta.get("dense_n_components") == self.n_components
+            and "dense_vectors" in arrays
+            and arrays["dense_vectors"].dtype == self.dtype
+        )
+
+    def _load_extra(self, meta, arrays):
+        super()._load_extra(meta, arrays)
+        if not self._saved_projection_usable(meta, arrays):
+            return
+        self.components = np.asarray(arrays["dense_components"])
+        self._components_vocabulary = self.vocabulary
+        self.dense_vectors = arrays["dense_vectors"]
+        if "ivf_list_rows" in arrays:
+            # Written by IVFSemanticSearch, which stores rows grouped by list.
+            self.dense_vectors = np.empty_like(arrays["dense_vectors"])
+            self.dense_vectors[arrays["ivf_list_rows"]] = arrays["dense_vectors"]
+        self._projected_rows = self.dense_vectors.shape[0]
+        self._projected_vectors = self.document_vectors
@@ -0,0 +1,197 @@
+from array import array
+
+import numpy as np
+
+from index_format import read_index, write_index
+
+
+class StringColumn:
+    """Append-only column of strings kept as one UTF-8 buffer plus offsets.
+
+    Row `i` is `blob[offsets[i]:offsets[i + 1]]`, decoded on access, so a
+    column costs 8 bytes per row on top of the encoded text instead of a
+    Python object per string. A column built from arrays (e.g. memory-mapped
+    index sections) is used in place and only copied if it is extended.
+    """
+
+    def __init__(self, blob=None, offsets=None):
+        if blob is None:
+            blob, offsets = bytearray(), array('q', [0])
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        start, stop = self._offsets[row], self._offsets[row + 1]
+        return bytes(self._blob[start:stop]).decode("utf-8")
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def extend(self, strings):
+        if not isinstance(self._blob, bytearray):
+            self._blob = bytearray(self._blob)
+            self._offsets = array('q', self._offsets)
+        for string in strings:
+            self._blob += string.encode("utf-8")
+            self._offsets.append(len(self._blob))
+
+    def arrays(self):
+        """`(blob, offsets)` as numpy arrays, in the layout `encode_strings` produces."""
+        return np.frombuffer(self._blob, dtype=np.uint8), np.frombuffer(self._offsets, dtype=np.int64)
+
+    @property
+    def nbytes(self):
+        return len(self._blob) + len(self._offsets) * 8
+
+
+class DocumentStore:
+    """Columnar `(id, text)` store behind `SimpleSemanticSearch.documents`.
+
+    `store[row]` returns the `(id, text)` pair, so it reads like the list of
+    tuples it replaces. Ids that are just row numbers (the default) take no
+    space; other integer ids are one int64 each and string ids are another
+    `StringColumn`. Extra named string columns can be added with `fields`,
+    for callers that keep per-document metadata alongside the text.
+    """
+
+    def __init__(self, fields=()):
+        self.texts = StringColumn()
+        self.fields = {name: StringColumn() for name in fields}
+        self._id_kind = "row"
+        self._ids = None
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, row):
+        row = int(row)
+        return self.id(row), self.texts[row]
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def id(self, row):
+        if self._id_kind == "row":
+            return row if row >= 0 else row + len(self)
+        return self._ids[row] if self._id_kind != "int" else int(self._ids[row])
+
+    def ids(self):
+        return [self.id(row) for row in range(len(self))]
+
+    def field(self, name, row):
+        return self.fields[name][int(row)]
+
+    def extend(self, ids, texts, **fields):
+        """Append `texts` with their `ids`; `fields` supply the extra columns, one value per text."""
+        texts = list(texts)
+        ids = list(range(len(self), len(self) + len(texts))) if ids is None else list(ids)
+        if len(ids) != len(texts):
+            raise ValueError("ids and texts must have the same length")
+        if set(fields) != set(self.fields):
+            raise ValueError(f"expected fields {sorted(self.fields)}, got {sorted(fields)}")
+
+        self._extend_ids(ids)
+        self.texts.extend(texts)
+        for name, values in fields.items():
+            self.fields[name].extend(values)
+
+    def take(self, rows):
+        """A new store holding `rows`, in that order, with their ids (row ids become explicit ints)."""
+        rows = [int(row) for row in rows]
+        store = DocumentStore(fields=self.fields)
+        store.extend(
+            [self.id(row) for row in rows], [self.texts[row] for row in rows],
+            **{name: [column[row] for row in rows] for name, column in self.fields.items()}
+        )
+        return store
+
+    def _extend_ids(self, ids):
+        start = len(self)
+        if self._id_kind == "row":
+            if all(isinstance(i, (int, np.integer)) and i == start + n for n, i in enumerate(ids)):
+                return
+            self._ids = array('q', range(start))
+            self._id_kind = "int"
+
+        if self._id_kind == "int":
+            if all(isinstance(i, (int, np.integer)) for i in ids):
+                if not isinstance(self._ids, array):
+                    self._ids = array('q', self._ids)
+                self._ids.extend(int(i) for i in ids)
+                return
+            previous = [int(i) for i in self._ids]
+            if start == 0 and all(isinstance(i, str) for i in ids):
+                self._ids = StringColumn()
+                self._id_kind = "str"
+            else:
+                self._ids = previous
+                self._id_kind = "object"
+
+        if self._id_kind == "str":
+            if all(isinstance(i, str) for i in ids):
+                self._ids.extend(ids)
+                return
+            self._ids = list(self._ids)
+            self._id_kind = "object"
+
+        self._ids.extend(ids)
+
+    @property
+    def nbytes(self):
+        """Approximate bytes held, excluding Python object overhead of `object` ids."""
+        total = self.texts.nbytes + sum(column.nbytes for column in self.fields.values())
+        if self._id_kind == "int":
+            total += len(self._ids) * 8
+        elif self._id_kind == "str":
+            total += self._ids.nbytes
+        return total
+
+    def to_arrays(self, prefix=""):
+        """Named arrays and meta describing the store, for `index_format.write_index`."""
+        arrays = {}
+        meta = {"id_kind": self._id_kind, "fields": list(self.fields)}
+        arrays[prefix + "text_blob"], arrays[prefix + "text_offsets"] = self.texts.arrays()
+        for n, column in enumerate(self.fields.values()):
+            arrays[f"{prefix}field{n}_blob"], arrays[f"{prefix}field{n}_offsets"] = column.arrays()
+
+        if self._id_kind == "int":
+            arrays[prefix + "ids"] = np.frombuffer(self._ids, dtype=np.int64) if isinstance(self._ids, array) else self._ids
+        elif self._id_kind == "str":
+            arrays[prefix + "id_blob"], arrays[prefix + "id_offsets"] = self._ids.arrays()
+        elif self._id_kind == "object":
+            raise ValueError("Only int or str document ids can be saved")
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, meta, arrays, prefix=""):
+        """Rebuild a store from `to_arrays` output; memory-mapped arrays are used in place."""
+        store = cls()
+        store.texts = StringColumn(arrays[prefix + "text_blob"], arrays[prefix + "text_offsets"])
+        store.fields = {
+            name: StringColumn(arrays[f"{prefix}field{n}_blob"], arrays[f"{prefix}field{n}_offsets"])
+            for n, name in enumerate(meta.get("fields", []))
+        }
+        store._id_kind = meta["id_kind"]
+        if store._id_kind == "int":
+            store._ids = arrays[prefix + "ids"]
+        elif store._id_kind == "str":
+            store._ids = StringColumn(arrays[prefix + "id_blob"], arrays[prefix + "id_offsets"])
+        return store
+
+    def save(self, path):
+        arrays, meta = self.to_arrays()
+        write_index(path, arrays, meta)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        meta, arrays = read_index(path, mmap=mmap)
+        return cls.from_arrays(meta, arrays)
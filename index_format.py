@@ -0,0 +1,99 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"SSIDX\x00\x00\x00"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def encode_strings(strings):
+    """Pack a list of strings into a UTF-8 byte blob plus an offsets array."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def decode_strings(blob, offsets):
+    raw = blob.tobytes() if isinstance(blob, np.ndarray) else bytes(blob)
+    offsets = offsets.tolist()
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def write_index(path, arrays, meta):
+    """Write named numpy arrays and a JSON-serialisable meta dict to `path`.
+
+    Layout: magic, format version, header length, JSON header, then each
+    array's raw little-endian bytes at a 64-byte aligned offset so it can be
+    memory-mapped directly.
+    """
+    sections = {}
+    offset = 0
+    prepared = []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+        offset = _align(offset)
+        sections[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        prepared.append((offset, array))
+        offset += array.nbytes
+
+    header = json.dumps({"meta": meta, "arrays": sections}).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for section_offset, array in prepared:
+            f.seek(data_start + section_offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_index(path, mmap=True):
+    """Read a file written by `write_index`, returning `(meta, arrays)`.
+
+    With `mmap=True` the arrays are read-only `numpy.memmap` views, so
+    processes loading the same file share its pages through the OS cache.
+    """
+    with open(path, "rb") as f:
+        magic, version, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a semantic search index file")
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index format version {version} (expected {FORMAT_VERSION})"
+            )
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    data_start = _align(_PREAMBLE.size + header_len)
+    arrays = {}
+    for name, section in header["arrays"].items():
+        dtype = np.dtype(section["dtype"])
+        shape = tuple(section["shape"])
+        count = int(np.prod(shape))
+        offset = data_start + section["offset"]
+        if count == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        else:
+            arrays[name] = np.fromfile(path, dtype=dtype, count=count, offset=offset).reshape(shape)
+    return header["meta"], arrays
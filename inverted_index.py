@@ -0,0 +1,156 @@
+import numpy as np
+
+from semantic_search import SimpleSemanticSearch
+
+
+class InvertedIndexSearch(SimpleSemanticSearch):
+    """SimpleSemanticSearch that scores queries from per-term posting lists.
+
+    Each term keeps its (sorted) document rows, their TF-IDF weights and the
+    largest weight in the list. Queries are scored term-at-a-time with
+    MaxScore pruning: once the current k-th best score (or the caller's
+    `min_score`) exceeds what the unprocessed terms could still add, those
+    terms only update existing candidates, and candidates that can no longer
+    reach the threshold are dropped. Work is proportional to the posting
+    lists of the query terms rather than the corpus size.
+
+    Only documents sharing at least one term with the query are returned, so
+    results may be shorter than `top_k`. A `filter` matching fewer rows than
+    the query terms' postings hold is scored row by row; otherwise
+    non-matching rows are dropped as the postings are merged.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._indexed_vectors = None
+        self._posting_offsets = None
+        self._posting_rows = None
+        self._posting_weights = None
+        self._max_impact = None
+
+    def _build_postings(self):
+        columns = self.document_vectors.tocsc()
+        columns.sort_indices()
+
+        offsets = columns.indptr
+        max_impact = np.zeros(columns.shape[1], dtype=np.float64)
+        non_empty = np.diff(offsets) > 0
+        if non_empty.any():
+            max_impact[non_empty] = np.maximum.reduceat(columns.data, offsets[:-1][non_empty])
+
+        self._posting_offsets = offsets
+        self._posting_rows = columns.indices
+        self._posting_weights = columns.data
+        self._max_impact = max_impact
+        self._indexed_vectors = self.document_vectors
+
+    def _postings(self, term):
+        start, stop = self._posting_offsets[term], self._posting_offsets[term + 1]
+        return self._posting_rows[start:stop], self._posting_weights[start:stop]
+
+    def _search(self, query, top_k, min_score, filter=None):
+        self._sync_vectors()
+        if self.document_vectors is None or top_k <= 0:
+            return []
+        if self._indexed_vectors is not self.document_vectors:
+            self._build_postings()
+        filter_rows = self._filter_rows(filter)
+
+        metrics = self.metrics
+        with metrics.timer("transform"):
+            query_vector = self.transform([query])
+        with metrics.timer("similarity"):
+            terms = query_vector.indices
+            postings = (self._posting_offsets[terms + 1] - self._posting_offsets[terms]).sum()
+            if filter_rows is not None and len(filter_rows) < postings:
+                rows, scores = self._score_filtered(query_vector, filter_rows, top_k, min_score)
+            else:
+                allowed = None
+                if filter_rows is not None:
+                    allowed = np.zeros(self.document_vectors.shape[0], dtype=bool)
+                    allowed[filter_rows] = True
+                elif len(self._deleted_rows):
+                    allowed = ~self._tombstones
+                rows, scores = self._max_score(query_vector, top_k, min_score, allowed)
+
+        results = []
+        for idx, score in zip(rows, scores):
+            doc_id, doc_text = self.documents[idx]
+            results.append((doc_id, doc_text, score))
+        return results
+
+    def _score_filtered(self, query_vector, rows, top_k, min_score):
+        scores = self._score_rows(query_vector, rows)[0]
+        keep = scores > 0 if min_score is None else (scores > 0) & (scores >= min_score)
+        rows, scores = rows[keep], scores[keep]
+        k = min(top_k, len(rows))
+        if k == 0:
+            return rows, scores
+        best, best_scores = self._select_top_k(scores[np.newaxis, :], k)
+        return rows[best[0]], best_scores[0]
+
+    def _max_score(self, query_vector, top_k, min_score, allowed=None):
+        terms = query_vector.indices
+        upper_bounds = query_vector.data * self._max_impact[terms]
+        order = np.argsort(-upper_bounds, kind='stable')
+        # remaining_after[i]: the most the terms after order[i] can still add.
+        remaining_after = np.append(np.cumsum(upper_bounds[order][::-1])[::-1][1:], 0.0)
+
+        threshold = 0.0 if min_score is None else min_score
+        remaining = upper_bounds.sum()
+
+        candidate_rows = np.empty(0, dtype=self._posting_rows.dtype)
+        candidate_scores = np.empty(0, dtype=np.float64)
+
+        for step, position in enumerate(order):
+            if remaining < threshold and not len(candidate_rows):
+                # No document can reach the threshold any more.
+                break
+
+            term_rows, term_weights = self._postings(terms[position])
+            contributions = query_vector.data[position] * term_weights
+
+            if remaining >= threshold:
+                if allowed is not None:
+                    # Filtered-out and tombstoned documents never become candidates.
+                    live = allowed[term_rows]
+                    term_rows = term_rows[live]
+                    contributions = contributions[live]
+                # Essential term: documents not seen yet may still qualify.
+                merged_rows = np.concatenate([candidate_rows, term_rows])
+                merged_scores = np.concatenate([candidate_scores, contributions])
+                candidate_rows, inverse = np.unique(merged_rows, return_inverse=True)
+                candidate_scores = np.bincount(
+                    inverse, weights=merged_scores, minlength=len(candidate_rows)
+                )
+            elif len(term_rows) < len(candidate_rows):
+                slots = np.searchsorted(candidate_rows, term_rows)
+                slots[slots == len(candidate_rows)] = 0
+                hits = candidate_rows[slots] == term_rows
+                candidate_scores[slots[hits]] += contributions[hits]
+            else:
+                slots = np.searchsorted(term_rows, candidate_rows)
+                slots[slots == len(term_rows)] = 0
+                hits = term_rows[slots] == candidate_rows
+                candidate_scores[hits] += contributions[slots[hits]]
+
+            remaining = remaining_after[step]
+
+            if len(candidate_scores) >= top_k:
+                kth_best = np.partition(candidate_scores, len(candidate_scores) - top_k)[-top_k]
+                threshold = max(threshold, kth_best)
+            keep = candidate_scores + remaining >= threshold
+            if not keep.all():
+                candidate_rows = candidate_rows[keep]
+                candidate_scores = candidate_scores[keep]
+
+        if min_score is not None:
+            keep = candidate_scores >= min_score
+            candidate_rows = candidate_rows[keep]
+            candidate_scores = candidate_scores[keep]
+
+        k = min(top_k, len(candidate_rows))
+        if k == 0:
+            return candidate_rows, candidate_scores
+        best, best_scores = self._select_top_k(candidate_scores[np.newaxis, :], k)
+        return candidate_rows[best[0]], best_scores[0]
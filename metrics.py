@@ -0,0 +1,204 @@
+import json
+import os
+import sys
+import threading
+import time
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in seconds, Prometheus style."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {"buckets": cumulative, "sum": self.sum, "count": self.count}
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics:
+    """Metrics that record nothing; the default, so instrumentation is free when off."""
+
+    enabled = False
+
+    def timer(self, stage):
+        return _NULL_TIMER
+
+    def observe(self, stage, seconds):
+        pass
+
+    def increment(self, name, value=1):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class Metrics:
+    """Per-stage latency histograms and counters with pluggable sinks.
+
+    Stages are timed with `with metrics.timer("transform"): ...`, counters are
+    bumped with `increment`. `flush()` hands a snapshot to every sink; with
+    `flush_interval` set a daemon thread does so periodically.
+    """
+
+    enabled = True
+
+    def __init__(self, sinks=None, buckets=DEFAULT_BUCKETS, flush_interval=None):
+        self.sinks = list(sinks or [])
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        if flush_interval:
+            thread = threading.Thread(target=self._flush_periodically, args=(flush_interval,), daemon=True)
+            thread.start()
+
+    def timer(self, stage):
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "counters": dict(self.counters),
+                "stages": {stage: h.snapshot() for stage, h in self.histograms.items()},
+            }
+
+    def flush(self):
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.emit(snapshot)
+
+    def _flush_periodically(self, interval):
+        while not self._closed.wait(interval):
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+
+
+class InMemorySink:
+    """Keeps every flushed snapshot in `snapshots`."""
+
+    def __init__(self):
+        self.snapshots = []
+
+    def emit(self, snapshot):
+        self.snapshots.append(snapshot)
+
+
+class JsonLogSink:
+    """Appends each snapshot as one JSON line to a file path or stream."""
+
+    def __init__(self, target=sys.stderr):
+        self.target = target
+
+    def emit(self, snapshot):
+        line = json.dumps(snapshot, default=str) + "\n"
+        if isinstance(self.target, str):
+            with open(self.target, 'a', encoding='utf-8') as f:
+                f.write(line)
+        else:
+            self.target.write(line)
+            self.target.flush()
+
+
+def format_prometheus(snapshot, prefix="semantic_search"):
+    lines = [
+        f"# HELP {prefix}_stage_seconds Time spent per request stage.",
+        f"# TYPE {prefix}_stage_seconds histogram",
+    ]
+    for stage, histogram in sorted(snapshot["stages"].items()):
+        for bound, count in histogram["buckets"]:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {count}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusFileSink:
+    """Rewrites `path` with the Prometheus text format on every flush (for node_exporter's textfile collector)."""
+
+    def __init__(self, path, prefix="semantic_search"):
+        self.path = path
+        self.prefix = prefix
+
+    def emit(self, snapshot):
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(format_prometheus(snapshot, self.prefix))
+        os.replace(tmp_path, self.path)
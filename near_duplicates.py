@@ -0,0 +1,168 @@
+import numpy as np
+
+from index_format import read_index, write_index
+from tfidf import char_ngram_hashes
+
+
+class NearDuplicateIndex:
+    """Streaming near-duplicate detection with MinHash signatures and LSH banding.
+
+    Each text is normalized (lowercased, punctuation dropped), cut into
+    character shingles of `shingle_size` and summarized by `num_perm`
+    MinHash values, whose agreement rate estimates the Jaccard similarity of
+    two shingle sets. The signature is split into `bands` bands; texts that
+    share any band land in the same bucket and are compared, so finding
+    candidates costs a few dictionary lookups per text instead of a pass over
+    everything seen so far.
+
+    `add` assigns every text a representative row: the first earlier text
+    whose estimated similarity is at least `threshold`, or the text itself.
+    Only representatives enter the buckets, so clusters do not chain through
+    a series of small edits. With the defaults (16 bands of 8 rows) a pair
+    at similarity 0.8 is a candidate with probability ~0.96, and one at 0.5
+    with ~0.06.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, bands=16, shingle_size=5, seed=0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+
+        rng = np.random.default_rng(seed)
+        self._multipliers = rng.integers(0, 2 ** 64 - 1, size=num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self._increments = rng.integers(0, 2 ** 64 - 1, size=num_perm, dtype=np.uint64, endpoint=True)
+
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._representatives = np.empty(0, dtype=np.int64)
+        self._n_rows = 0
+        self._clusters = None
+
+    def __len__(self):
+        return self._n_rows
+
+    @property
+    def representatives(self):
+        """Representative row of every row added so far (a row is its own when it is unique)."""
+        return self._representatives[:self._n_rows]
+
+    def signatures(self, texts, max_shingles=1 << 12):
+        """`(len(texts), num_perm)` uint32 MinHash signatures.
+
+        Shingles are hashed about `max_shingles` at a time (whole texts per
+        pass), which keeps the `num_perm`-row work buffer small enough to
+        stay in cache.
+        """
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        if not len(texts):
+            return signatures
+        hashes, offsets = char_ngram_hashes(texts, self.shingle_size)
+
+        start = 0
+        while start < len(texts):
+            stop = max(start + 1, int(np.searchsorted(offsets, offsets[start] + max_shingles, side='right')) - 1)
+            stop = min(stop, len(texts))
+            block = hashes[offsets[start]:offsets[stop]]
+            # Multiply-shift hashing: one random odd multiplier per permutation.
+            permuted = np.multiply(self._multipliers[:, None], block[None, :])
+            permuted += self._increments[:, None]
+            permuted >>= np.uint64(32)
+            minima = np.minimum.reduceat(permuted, offsets[start:stop] - offsets[start], axis=1)
+            signatures[start:stop] = minima.T
+            start = stop
+        return signatures
+
+    def _store(self, signatures, representatives):
+        needed = self._n_rows + len(signatures)
+        if needed > len(self._representatives):
+            capacity = max(needed, 2 * len(self._representatives))
+            grown = np.empty((capacity, self.num_perm), dtype=np.uint32)
+            grown[:self._n_rows] = self._signatures[:self._n_rows]
+            self._signatures = grown
+            self._representatives = np.resize(self._representatives, capacity)
+        self._signatures[self._n_rows:needed] = signatures
+        self._representatives[self._n_rows:needed] = representatives
+        self._n_rows = needed
+
+    def add(self, texts):
+        """Add `texts` as the next rows; returns the representative row of each."""
+        if self._signatures is None:
+            raise ValueError("a loaded NearDuplicateIndex only keeps its cluster mapping and cannot add")
+        signatures = self.signatures(texts)
+        start = self._n_rows
+        representatives = np.arange(start, start + len(texts), dtype=np.int64)
+        self._store(signatures, representatives)
+
+        rows_per_band = self.num_perm // self.bands
+        min_matches = self.threshold * self.num_perm
+        for i, signature in enumerate(signatures):
+            row = start + i
+            keys = [band.tobytes() for band in signature.reshape(self.bands, rows_per_band)]
+            candidates = {bucket[key] for bucket, key in zip(self._buckets, keys) if key in bucket}
+
+            best, best_matches = None, 0
+            for candidate in candidates:
+                matches = np.count_nonzero(self._signatures[candidate] == signature)
+                if matches >= min_matches and (best is None or matches > best_matches):
+                    best, best_matches = candidate, matches
+
+            if best is None:
+                for bucket, key in zip(self._buckets, keys):
+                    bucket.setdefault(key, row)
+            else:
+                representatives[i] = best
+                self._representatives[row] = best
+
+        self._clusters = None
+        return representatives
+
+    def members(self, row):
+        """All rows in the cluster of `row` (its representative first)."""
+        if self._clusters is None:
+            clusters = {}
+            for member, representative in enumerate(self.representatives.tolist()):
+                if member != representative:
+                    clusters.setdefault(representative, [representative]).append(member)
+            self._clusters = clusters
+        representative = int(self.representatives[row])
+        return self._clusters.get(representative, [representative])
+
+    def report(self):
+        """How much collapsing duplicates to their representatives removed."""
+        representatives = self.representatives
+        sizes = np.bincount(representatives, minlength=self._n_rows) if self._n_rows else np.zeros(0, dtype=np.int64)
+        kept = int(np.count_nonzero(sizes))
+        return {
+            "rows": self._n_rows,
+            "kept": kept,
+            "removed": self._n_rows - kept,
+            "removed_ratio": (self._n_rows - kept) / max(1, self._n_rows),
+            "clusters": int(np.count_nonzero(sizes > 1)),
+            "largest_cluster": int(sizes.max(initial=0)),
+            "threshold": self.threshold,
+        }
+
+    def save(self, path):
+        """Write the cluster mapping (not the signatures) to `path`."""
+        meta = {
+            "threshold": self.threshold,
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+            "shingle_size": self.shingle_size,
+            "seed": self.seed,
+        }
+        write_index(path, {"representatives": self.representatives}, meta)
+
+    @classmethod
+    def load(cls, path):
+        """Read a mapping written by `save`; the result answers `members` and `report` but cannot `add`."""
+        meta, arrays = read_index(path, mmap=False)
+        index = cls(**meta)
+        index._representatives = np.asarray(arrays["representatives"])
+        index._n_rows = len(index._representatives)
+        index._signatures = None
+        return index
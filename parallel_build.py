@@ -0,0 +1,94 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from tfidf import build_analyzer, count_terms, l2_normalize, smoothed_idf
+
+
+def _count_shard(texts, stop_words):
+    vocabulary = {}
+    counts = count_terms(texts, build_analyzer(stop_words), vocabulary)
+    return list(vocabulary), counts
+
+
+def _split(texts, n_shards):
+    bounds = np.linspace(0, len(texts), n_shards + 1).astype(int)
+    return [texts[start:stop] for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def resolve_jobs(n_jobs):
+    """Worker count for an `n_jobs` setting: -1 or None means all cores."""
+    if n_jobs is None or n_jobs < 1:
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def count_terms_sharded(texts, stop_words, vocabulary, n_jobs=1, executor=None):
+    """`count_terms(texts, build_analyzer(stop_words), vocabulary)`, tokenized in `n_jobs` processes.
+
+    Each worker counts a contiguous shard with its own local vocabulary; the
+    parent adds unseen terms to `vocabulary` in first-seen order across the
+    shards and remaps the blocks, so the result (vocabulary included) is
+    identical to a single-process count. `executor` is a process pool to use
+    instead of starting one for this call.
+    """
+    shards = _split(list(texts), resolve_jobs(n_jobs))
+    stop_words = sorted(stop_words or ())
+    if len(shards) > 1 and executor is not None:
+        counted = list(executor.map(_count_shard, shards, [stop_words] * len(shards)))
+    elif len(shards) > 1:
+        with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            counted = list(executor.map(_count_shard, shards, [stop_words] * len(shards)))
+    else:
+        counted = [_count_shard(shard, stop_words) for shard in shards]
+
+    blocks = []
+    for shard_terms, counts in counted:
+        for term in shard_terms:
+            if term not in vocabulary:
+                vocabulary[term] = len(vocabulary)
+        mapping = np.fromiter((vocabulary[term] for term in shard_terms), dtype=np.int32, count=len(shard_terms))
+        block = sparse.csr_matrix(
+            (counts.data, mapping[counts.indices], counts.indptr),
+            shape=(counts.shape[0], len(vocabulary))
+        )
+        block.sort_indices()
+        blocks.append(block)
+    for block in blocks:
+        block.resize(block.shape[0], len(vocabulary))
+    if not blocks:
+        return sparse.csr_matrix((0, len(vocabulary)), dtype=np.float64)
+    return sparse.vstack(blocks, format='csr')
+
+
+def fit_transform(texts, stop_words, n_jobs=1):
+    """Fit TF-IDF on `texts`; returns `(vectors, vocabulary, idf)`.
+
+    Matches `TfidfVectorizer(stop_words=stop_words).fit_transform` exactly,
+    vocabulary and row order included, without importing sklearn. With
+    `n_jobs` other than 1 (-1 or None for all cores) the texts are counted
+    by `count_terms_sharded`; the parent then renumbers the columns in
+    sklearn's order and applies the smoothed IDF and L2 normalization.
+    """
+    # Number terms in first-seen order across the (contiguous) shards, as a
+    # single CountVectorizer pass would, so rows keep sklearn's index order.
+    first_seen = {}
+    counts = count_terms_sharded(texts, stop_words, first_seen, n_jobs)
+    if not first_seen:
+        raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+
+    # Then renumber columns alphabetically without re-sorting rows.
+    terms = sorted(first_seen)
+    vocabulary = {term: i for i, term in enumerate(terms)}
+    renumber = np.empty(len(terms), dtype=np.int32)
+    for term, column in first_seen.items():
+        renumber[column] = vocabulary[term]
+    counts.indices = renumber[counts.indices]
+
+    document_frequency = np.bincount(counts.indices, minlength=len(terms))
+    idf = smoothed_idf(document_frequency, counts.shape[0])
+
+    counts.data *= idf[counts.indices]
+    return l2_normalize(counts), vocabulary, idf
@@ -0,0 +1,247 @@
+import time
+
+import numpy as np
+from scipy import sparse
+
+from parallel_build import fit_transform
+from semantic_search import SimpleSemanticSearch
+
+QUANTIZED_DTYPES = (np.float16, np.uint8)
+
+
+def _index_dtype(n_columns):
+    return np.uint16 if n_columns <= np.iinfo(np.uint16).max + 1 else np.int32
+
+
+class QuantizedMatrix:
+    """Row-major sparse matrix with narrow values and column indices.
+
+    Values are float16, or uint8 with one float32 scale per row (the row's
+    largest value maps to 255; TF-IDF weights are never negative, so the
+    sign bit would be wasted). Column indices are uint16 when there are at
+    most 65536 columns and int32 otherwise. It exposes `data`, `indices`,
+    `indptr` and `shape` like a CSR matrix.
+    """
+
+    def __init__(self, data, indices, indptr, shape, scales=None):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = tuple(shape)
+        self.scales = scales
+
+    @classmethod
+    def from_csr(cls, vectors, dtype=np.uint8):
+        dtype = np.dtype(dtype)
+        if dtype not in QUANTIZED_DTYPES:
+            raise ValueError("dtype must be float16 or uint8")
+        vectors = vectors.tocsr()
+        indices = vectors.indices.astype(_index_dtype(vectors.shape[1]))
+        if dtype == np.float16:
+            return cls(vectors.data.astype(np.float16), indices, vectors.indptr.copy(), vectors.shape)
+
+        row_lengths = np.diff(vectors.indptr)
+        nonempty = row_lengths > 0
+        scales = np.ones(vectors.shape[0], dtype=np.float32)
+        if vectors.nnz:
+            scales[nonempty] = np.maximum.reduceat(vectors.data, vectors.indptr[:-1][nonempty]) / 255
+        scales[scales == 0] = 1
+        data = np.rint(vectors.data / np.repeat(scales, row_lengths)).astype(np.uint8)
+        return cls(data, indices, vectors.indptr.copy(), vectors.shape, scales)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        scales = 0 if self.scales is None else self.scales.nbytes
+        return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes + scales
+
+    def _block(self, start, stop, dtype=np.float32):
+        begin, end = self.indptr[start], self.indptr[stop]
+        data = self.data[begin:end].astype(dtype)
+        if self.scales is not None:
+            data *= np.repeat(self.scales[start:stop].astype(dtype), np.diff(self.indptr[start:stop + 1]))
+        return sparse.csr_matrix(
+            (data, self.indices[begin:end].astype(np.int32), self.indptr[start:stop + 1] - begin),
+            shape=(stop - start, self.shape[1])
+        )
+
+    def tocsr(self):
+        """Dequantized float64 CSR copy."""
+        return self._block(0, self.shape[0], np.float64)
+
+    def score(self, query_vectors, block_size=65536):
+        """Dense `(n_queries, n_rows)` float32 products with `query_vectors`.
+
+        Rows are widened to float32 `block_size` at a time, so the full
+        matrix never exists at full precision.
+        """
+        queries = sparse.csr_matrix(query_vectors, dtype=np.float32)
+        queries.resize(queries.shape[0], self.shape[1])
+        scores = np.empty((queries.shape[0], self.shape[0]), dtype=np.float32)
+        for start in range(0, self.shape[0], block_size):
+            stop = min(start + block_size, self.shape[0])
+            scores[:, start:stop] = (queries @ self._block(start, stop).T).toarray()
+        return scores
+
+    def take_rows(self, rows, dtype=np.float32):
+        """Dequantized CSR matrix of just `rows`, in that order."""
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        data = self.data[positions].astype(dtype)
+        if self.scales is not None:
+            data *= np.repeat(self.scales[rows].astype(dtype), lengths)
+        return sparse.csr_matrix(
+            (data, self.indices[positions].astype(np.int32), indptr), shape=(len(rows), self.shape[1])
+        )
+
+    def score_rows(self, query_vectors, rows):
+        """Like `score`, but only against `rows`: a `(n_queries, len(rows))` float32 array."""
+        queries = sparse.csr_matrix(query_vectors, dtype=np.float32)
+        queries.resize(queries.shape[0], self.shape[1])
+        return (queries @ self.take_rows(rows).T).toarray()
+
+    def append(self, new_vectors):
+        """A new matrix with the float64 CSR rows `new_vectors` quantized and appended."""
+        n_columns = max(self.shape[1], new_vectors.shape[1])
+        new = QuantizedMatrix.from_csr(new_vectors, self.dtype)
+        index_dtype = np.promote_types(_index_dtype(n_columns), self.indices.dtype)
+        scales = None
+        if self.scales is not None:
+            scales = np.concatenate([self.scales, new.scales])
+        return QuantizedMatrix(
+            np.concatenate([self.data, new.data]),
+            np.concatenate([self.indices, new.indices]).astype(index_dtype, copy=False),
+            np.concatenate([self.indptr[:-1], new.indptr + self.indptr[-1]]),
+            (self.shape[0] + new.shape[0], n_columns),
+            scales
+        )
+
+
+class QuantizedSemanticSearch(SimpleSemanticSearch):
+    """SimpleSemanticSearch that keeps `document_vectors` quantized.
+
+    The TF-IDF matrix is stored as a `QuantizedMatrix` of `dtype` (float16,
+    or uint8 with per-row scales) with uint16 column indices when the
+    vocabulary fits, i.e. 3-4 bytes per non-zero instead of 12. Queries are
+    scored on it directly, widening `block_size` rows at a time, so scores
+    are float32 and may differ from the float64 ones in the last digits;
+    `recall_report` shows what that does to the ranking on a given corpus.
+
+    `save` writes the quantized arrays next to a dequantized float64 copy,
+    which keeps the file readable by the other engines; `load` maps only
+    the quantized arrays.
+    """
+
+    def __init__(self, *args, dtype=np.uint8, block_size=65536, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in QUANTIZED_DTYPES:
+            raise ValueError("dtype must be float16 or uint8")
+        self.block_size = block_size
+
+    def _store_vectors(self, vectors):
+        return QuantizedMatrix.from_csr(vectors, self.dtype)
+
+    def _append_vectors(self, vectors, new_vectors):
+        return vectors.append(new_vectors)
+
+    def _score(self, query_vectors):
+        return self.document_vectors.score(query_vectors, self.block_size)
+
+    def _score_rows(self, query_vectors, rows):
+        return self.document_vectors.score_rows(query_vectors, rows)
+
+    def memory_usage(self):
+        usage = super().memory_usage()
+        if self.document_vectors is not None and self.document_vectors.scales is not None:
+            usage["row_scales_bytes"] = self.document_vectors.scales.nbytes
+        return usage
+
+    def recall_report(self, queries, top_k=10, dtypes=QUANTIZED_DTYPES, batch_size=256):
+        """Recall@`top_k` of quantized rankings against the float64 baseline.
+
+        The float64 vectors are refitted from the stored documents for the
+        comparison (they are not kept), so this costs a full build.
+        """
+        self.refresh()
+        baseline = SimpleSemanticSearch(stop_words=self.stop_words)
+        baseline.documents = self.documents
+        baseline.document_vectors, baseline.vocabulary, baseline.idf = fit_transform(
+            self.documents.texts, self.stop_words, self.n_jobs
+        )
+        return recall_report(baseline, queries, top_k, dtypes, self.block_size, batch_size)
+
+    def _save_extra(self, arrays, meta):
+        super()._save_extra(arrays, meta)
+        vectors = self.document_vectors
+        arrays["quantized_data"] = vectors.data
+        arrays["quantized_indices"] = vectors.indices
+        arrays["quantized_indptr"] = vectors.indptr
+        if vectors.scales is not None:
+            arrays["quantized_scales"] = vectors.scales
+
+    def _load_extra(self, meta, arrays):
+        super()._load_extra(meta, arrays)
+        if "quantized_data" in arrays and arrays["quantized_data"].dtype == self.dtype:
+            self.document_vectors = QuantizedMatrix(
+                arrays["quantized_data"], arrays["quantized_indices"], arrays["quantized_indptr"],
+                meta["shape"], arrays.get("quantized_scales")
+            )
+        else:
+            self.document_vectors = self._store_vectors(self.document_vectors)
+
+
+def recall_report(engine, queries, top_k=10, dtypes=QUANTIZED_DTYPES, block_size=65536, batch_size=256):
+    """Compare quantized scoring of `engine`'s float64 vectors with the float64 ranking.
+
+    For each dtype reports recall@`top_k` (overlap with the exact top-k),
+    the largest absolute error of the returned scores, bytes per non-zero
+    and query latency, next to the float64 figures.
+    """
+    vectors = engine.document_vectors
+    k = min(top_k, vectors.shape[0])
+    query_vectors = engine.transform(queries)
+
+    start = time.perf_counter()
+    truth, _ = engine.search_batch(queries, top_k=k, batch_size=batch_size)
+    baseline_seconds = time.perf_counter() - start
+    truth_sets = [set(row) for row in truth.tolist()]
+
+    report = {
+        "top_k": k,
+        "float64": {
+            "bytes_per_nnz": (vectors.data.nbytes + vectors.indices.nbytes) / max(1, vectors.nnz),
+            "ms_per_query": baseline_seconds * 1000 / max(1, len(queries)),
+        },
+    }
+    for dtype in dtypes:
+        quantized = QuantizedMatrix.from_csr(vectors, dtype)
+        hits = 0
+        max_error = 0.0
+        seconds = 0.0
+        for offset in range(0, len(queries), batch_size):
+            batch = query_vectors[offset:offset + batch_size]
+            start = time.perf_counter()
+            indices, top_scores = SimpleSemanticSearch._select_top_k(quantized.score(batch, block_size), k)
+            seconds += time.perf_counter() - start
+
+            exact = np.take_along_axis((batch @ vectors.T).toarray(), indices, axis=1)
+            max_error = max(max_error, float(np.abs(exact - top_scores).max(initial=0)))
+            hits += sum(len(expected.intersection(found)) for expected, found in zip(truth_sets[offset:], indices.tolist()))
+        report[np.dtype(dtype).name] = {
+            "recall": hits / max(1, k * len(queries)),
+            "max_score_error": max_error,
+            "bytes_per_nnz": (quantized.data.nbytes + quantized.indices.nbytes) / max(1, quantized.nnz),
+            "ms_per_query": seconds * 1000 / max(1, len(queries)),
+        }
+    return report
@@ -0,0 +1,205 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from semantic_search import SimpleSemanticSearch
+from tfidf import char_ngram_hashes
+
+# Odd 64-bit multiplier; the top 32 bits of the product are an n-gram's key.
+_KEY_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def char_ngram_keys(texts, ngram_size=3):
+    """Distinct character n-grams of each text, as 32-bit hash keys.
+
+    N-grams are taken from each text's `tfidf.normalize_text` form. Returns
+    `(keys, counts, offsets)`: text `i` has the sorted uint32 `keys` and
+    their occurrence `counts` at `offsets[i]:offsets[i + 1]`. A misspelled
+    word keeps most of its n-grams ("pasword" has 5 of the 6 trigrams of
+    "password").
+    """
+    hashes, offsets = char_ngram_hashes(texts, ngram_size)
+    keys = (hashes * _KEY_MULTIPLIER) >> np.uint64(32)
+    rows = np.repeat(np.arange(len(texts), dtype=np.uint64), np.diff(offsets))
+    combined, counts = np.unique((rows << np.uint64(32)) | keys, return_counts=True)
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(np.bincount((combined >> np.uint64(32)).astype(np.int64), minlength=len(texts)), out=offsets[1:])
+    return (combined & np.uint64(0xFFFFFFFF)).astype(np.uint32), counts, offsets
+
+
+class TwoStageSemanticSearch(SimpleSemanticSearch):
+    """SimpleSemanticSearch that re-ranks its word-level hits by character n-gram overlap.
+
+    The first stage is the usual word-level TF-IDF search, asked for
+    `candidates` results. Each candidate with a positive first-stage score
+    then gets a char score: the share of the query's character n-grams
+    (stop words removed, counts damped to `1 + log(count)`) that occur in
+    the candidate. Results are ordered by
+    `(1 - char_weight) * word_score + char_weight * char_score`, so a query
+    with a typo still finds the document it meant once any of its other
+    words bring it into the candidates. Candidates without a positive word
+    score keep their first-stage score.
+
+    No character index is built: n-gram keys are computed for candidate rows
+    only and kept in an LRU cache of `cache_rows` rows. Computing them is
+    the cost of the second stage, so `rerank_budget` (seconds per query,
+    None for no limit) bounds it: keys are computed in first-stage order,
+    and once a batch runs out of budget the remaining candidates keep a
+    char score of 0 (counted as "rerank_truncated"). The time is recorded
+    as the metrics stages "rerank_ngrams" and "rerank"; `rerank_report`
+    compares it with the first stage on a set of queries.
+    """
+
+    # Candidate rows processed per call while working through a budget.
+    NGRAM_CHUNK = 64
+
+    def __init__(self, *args, candidates=300, char_weight=0.5, ngram_size=3,
+                 cache_rows=50000, rerank_budget=0.02, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.candidates = candidates
+        self.char_weight = char_weight
+        self.ngram_size = ngram_size
+        self.cache_rows = cache_rows
+        self.rerank_budget = rerank_budget
+        self._char_cache = OrderedDict()
+        self._char_cache_documents = None
+
+    def _ngram_keys(self, texts):
+        return char_ngram_keys([" ".join(self._analyzer(text)) for text in texts], self.ngram_size)
+
+    def _search_batch(self, queries, top_k, batch_size, filter=None):
+        indices, scores = super()._search_batch(queries, max(top_k, self.candidates), batch_size, filter)
+        k = min(top_k, indices.shape[1])
+        if not self.char_weight or not indices.size:
+            return indices[:, :k], scores[:, :k]
+
+        with self.metrics.timer("rerank"):
+            scores, truncated = self._rerank(queries, indices, scores)
+            if truncated:
+                self.metrics.increment("rerank_truncated", truncated)
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+    def _rerank(self, queries, indices, scores):
+        """Blended scores for the first-stage `(indices, scores)`, and how many queries ran out of budget."""
+        deadline = None
+        if self.rerank_budget is not None:
+            deadline = time.perf_counter() + self.rerank_budget * len(queries)
+
+        weight = self.char_weight
+        query_keys, query_counts, query_offsets = self._ngram_keys(queries)
+        query_weights = 1 + np.log(query_counts)
+        blended = scores.copy()
+        truncated = 0
+        # Rows are sorted by word score, so the positive ones are a prefix.
+        n_positive = np.count_nonzero(scores > 0, axis=1)
+        for i, n in enumerate(n_positive.tolist()):
+            begin, end = query_offsets[i], query_offsets[i + 1]
+            if not n or begin == end:
+                continue
+            keys, offsets = self._candidate_keys(indices[i, :n], deadline)
+            char_scores = self._coverage(keys, offsets, query_keys[begin:end], query_weights[begin:end])
+            truncated += len(char_scores) < n
+            blended[i, :n] *= 1 - weight
+            blended[i, :len(char_scores)] += weight * char_scores
+        return blended, truncated
+
+    @staticmethod
+    def _coverage(keys, offsets, query_keys, query_weights):
+        # Share of the query's n-gram weight found in each candidate, by
+        # looking every candidate key up in the sorted query keys.
+        positions = np.minimum(np.searchsorted(query_keys, keys), len(query_keys) - 1)
+        found = np.where(query_keys[positions] == keys, query_weights[positions], 0)
+        n_rows = len(offsets) - 1
+        rows = np.repeat(np.arange(n_rows), np.diff(offsets))
+        return np.bincount(rows, weights=found, minlength=n_rows) / query_weights.sum()
+
+    def _candidate_keys(self, rows, deadline=None):
+        """N-gram keys of `rows` (or of the longest prefix done before `deadline`) as `(keys, offsets)`."""
+        cache = self._char_cache
+        if self._char_cache_documents is not self.documents:
+            # A compaction (or load) renumbered the rows.
+            cache.clear()
+            self._char_cache_documents = self.documents
+
+        rows = rows.tolist()
+        missing = [row for row in rows if row not in cache]
+        self.metrics.increment("rerank_cache_hits", len(rows) - len(missing))
+        available = len(rows)
+        if missing:
+            with self.metrics.timer("rerank_ngrams"):
+                texts = self.documents.texts
+                for start in range(0, len(missing), self.NGRAM_CHUNK):
+                    if deadline is not None and start and time.perf_counter() > deadline:
+                        available = rows.index(missing[start])
+                        break
+                    chunk = missing[start:start + self.NGRAM_CHUNK]
+                    keys, _, offsets = self._ngram_keys([texts[row] for row in chunk])
+                    for n, row in enumerate(chunk):
+                        cache[row] = keys[offsets[n]:offsets[n + 1]].copy()
+                    self.metrics.increment("rerank_cache_misses", len(chunk))
+
+        entries = [cache[row] for row in rows[:available]]
+        for row in rows[:available]:
+            cache.move_to_end(row)
+        while len(cache) > self.cache_rows:
+            cache.popitem(last=False)
+
+        offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+        np.cumsum([len(keys) for keys in entries], out=offsets[1:])
+        keys = np.concatenate(entries) if entries else np.empty(0, dtype=np.uint32)
+        return keys, offsets
+
+    def memory_usage(self):
+        usage = super().memory_usage()
+        usage["char_cache_bytes"] = sum(keys.nbytes for keys in self._char_cache.values())
+        return usage
+
+    def rerank_report(self, queries, top_k=10, batch_size=256):
+        """What the second stage costs and changes on `queries`.
+
+        Times the word-level search alone for `candidates` results, then the
+        two-stage search with a cold cache and again with a warm one. Also
+        reports the fraction of the first stage's top `top_k` that re-ranking
+        replaced and how many queries ran out of budget. The cache is left
+        warm.
+        """
+        with self.lock:
+            self._char_cache.clear()
+            n_queries = max(1, len(queries))
+
+            start = time.perf_counter()
+            first, _ = super()._search_batch(queries, self.candidates, batch_size)
+            first_seconds = time.perf_counter() - start
+
+            timings = []
+            truncated = []
+            for _ in range(2):
+                start = time.perf_counter()
+                indices, scores = super()._search_batch(queries, self.candidates, batch_size)
+                blended, n_truncated = self._rerank(queries, indices, scores)
+                order = np.argsort(-blended, axis=1, kind='stable')[:, :top_k]
+                reranked = np.take_along_axis(indices, order, axis=1)
+                timings.append(time.perf_counter() - start)
+                truncated.append(n_truncated)
+
+            k = min(top_k, first.shape[1])
+            changed = sum(
+                len(set(before[:k]) - set(after[:k]))
+                for before, after in zip(first.tolist(), reranked.tolist())
+            )
+            return {
+                "candidates": self.candidates,
+                "top_k": k,
+                "first_stage_ms_per_query": first_seconds * 1000 / n_queries,
+                "two_stage_cold_ms_per_query": timings[0] * 1000 / n_queries,
+                "two_stage_warm_ms_per_query": timings[1] * 1000 / n_queries,
+                "second_stage_cold_ms_per_query": (timings[0] - first_seconds) * 1000 / n_queries,
+                "second_stage_warm_ms_per_query": (timings[1] - first_seconds) * 1000 / n_queries,
+                "changed_top_k": changed / max(1, k * len(queries)),
+                "truncated_queries_cold": truncated[0],
+                "truncated_queries_warm": truncated[1],
+                "cache_rows": len(self._char_cache),
+                "cache_bytes": self.memory_usage()["char_cache_bytes"],
+            }
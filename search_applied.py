@@ -1,15 +1,21 @@
-import pandas as pd
-from semantic_search import TextStreamer, SimpleSemanticSearch
+from semantic_search import TextStreamer, SimpleSemanticSearch, astream_response, stream_response
+from metrics import NULL_METRICS
 import json
 import os
 import sys
 import time
-import random
 
 class StreamingKnowledgeBase:
-    """A knowledge base assistant that streams responses with thinking steps."""
+    """A knowledge base assistant that streams responses with thinking steps.
     
-    def __init__(self, knowledge_data, stream_speed=0.02, thinking_speed=0.003):
+    Articles are indexed with their category, so `respond` and friends
+    take a `filter` such as `{"category": ["Physics", "Security"]}` to
+    answer from those categories only.
+    """
+    
+    NO_ANSWER = "I don't have enough information to answer that question accurately. Could you try rephrasing or asking something else?"
+    
+    def __init__(self, knowledge_data, stream_speed=0.02, thinking_speed=0.003, search_engine_cls=SimpleSemanticSearch, metrics=None):
 
         self.knowledge_data = knowledge_data
         
@@ -21,9 +27,13 @@ class StreamingKnowledgeBase:
             f"{title}. {content}" for title, content in zip(self.titles, self.contents)
         ]
         
-        self.search_engine = SimpleSemanticSearch()
-        self.search_engine.add_documents(self.search_texts)
+        self.metrics = metrics or NULL_METRICS
+        self.search_engine = search_engine_cls(fields=("category",))
+        self.search_engine.metrics = self.metrics
+        self.search_engine.add_documents(self.search_texts, fields={"category": self.categories})
         
+        self.stream_speed = stream_speed
+        self.thinking_speed = thinking_speed
         self.answer_streamer = TextStreamer(stream_interval=stream_speed)
         self.thinking_streamer = TextStreamer(stream_interval=thinking_speed)
         
@@ -31,9 +41,16 @@ class StreamingKnowledgeBase:
         self.thinking_streamer.start()
     
     def _generate_thinking_steps(self, query, results):
-        thinking_steps = [
+        return self._query_thinking_steps(query) + self._result_thinking_steps(query, results)
+    
+    def _query_thinking_steps(self, query):
+        return [
             f"Analyzing query: '{query}'",
-            "Searching knowledge base...",
+            "Searching knowledge base..."
+        ]
+    
+    def _result_thinking_steps(self, query, results):
+        thinking_steps = [
             f"Found {len(results)} relevant documents",
             "Ranking results by relevance...",
             "Extracting key information...",
@@ -43,38 +60,30 @@ class StreamingKnowledgeBase:
         for i, (doc_id, _, score) in enumerate(results[:3]):
             title = self.titles[doc_id]
             category = self.categories[doc_id]
-            thinking_steps.insert(3 + i, f"Found relevant article: '{title}' (Category: {category}, Relevance: {score:.2f})")
+            thinking_steps.insert(1 + i, f"Found relevant article: '{title}' (Category: {category}, Relevance: {score:.2f})")
         
         return thinking_steps
     
-    def respond(self, query, show_thinking=True):
-        results = self.search_engine.search(query, top_k=3)
-        
+    def _candidates(self, query, filter=None):
+        return self.search_engine.search(query, top_k=3, filter=filter)
+    
+    def _relevant(self, results):
         if not results or results[0][2] < 0.3:
-            response = "I don't have enough information to answer that question accurately. Could you try rephrasing or asking something else?"
-            self.answer_streamer.put(response)
             return None
-        
-        if show_thinking:
-            thinking_steps = self._generate_thinking_steps(query, results)
-            print("\nThinking: ", end="")
-            
-            for step in thinking_steps:
-                self.thinking_streamer.put(step + "... ")
-                self.thinking_streamer.wait_until_done()
-                time.sleep(0.2 + random.random() * 0.3)  # Random pause between steps
-            
-            print("\n\nAnswer: ", end="")
-        
+        return results
+    
+    def _retrieve(self, query, filter=None):
+        return self._relevant(self._candidates(query, filter))
+    
+    def _build_response(self, query, results):
         doc_id, _, score = results[0]
         title = self.titles[doc_id]
         content = self.contents[doc_id]
         category = self.categories[doc_id]
         
         answer = self._format_answer(query, content, title)
-        self.answer_streamer.put(answer)
         
-        return {
+        return answer, {
             "title": title,
             "category": category,
             "confidence": score,
@@ -82,6 +91,73 @@ class StreamingKnowledgeBase:
             "related_titles": [self.titles[r[0]] for r in results[1:3]]
         }
     
+    def respond(self, query, show_thinking=True, filter=None, pipelined=False, cut_thinking=False):
+        """Answer `query` on the streamers; returns the response info, or None when nothing matched.
+        
+        With `pipelined` the search runs while the first thinking steps are
+        shown and the answer starts the moment they finish; `cut_thinking`
+        also skips the remaining steps once it is ready (see
+        `stream_response`). The info then includes
+        "time_to_first_answer_byte" in seconds.
+        """
+        started = time.monotonic()
+        metrics = self.metrics
+        metrics.increment("respond_queries")
+        
+        with metrics.timer("respond"):
+            response_info, first_byte = stream_response(
+                self.thinking_streamer, self.answer_streamer,
+                lambda: self._retrieve(query, filter),
+                lambda results: self._build_response(query, results),
+                self.NO_ANSWER,
+                query_steps=self._query_thinking_steps(query) if show_thinking else (),
+                result_steps=(lambda results: self._result_thinking_steps(query, results)) if show_thinking else None,
+                metrics=metrics, pipelined=pipelined, cut_thinking=cut_thinking, started=started
+            )
+            
+            if response_info is None:
+                metrics.increment("rejections")
+                return None
+            if pipelined:
+                response_info["time_to_first_answer_byte"] = first_byte
+            return response_info
+    
+    def respond_quiet(self, query, filter=None):
+        """`respond` without streaming or pacing, for batch runs.
+        
+        Returns `(results, info)`: the search hits and the dict `respond`
+        would return. When nothing is relevant enough info is None and the
+        results are the hits that fell below the threshold.
+        """
+        self.metrics.increment("respond_queries")
+        candidates = self._candidates(query, filter)
+        results = self._relevant(candidates)
+        if results is None:
+            self.metrics.increment("rejections")
+            return candidates, None
+        return results, self._build_response(query, results)[1]
+    
+    async def respond_async(self, query, show_thinking=True, paced=True, executor=None, filter=None):
+        """Async version of `respond` that yields `(kind, payload)` events instead of printing.
+        
+        `kind` is "thinking" or "answer" for text chunks, and the last event is
+        `("result", info)` with the dict `respond` would return (or None). The
+        search runs in `executor` (the loop's default when None) and all
+        pacing uses `asyncio.sleep`, so one event loop can serve many
+        conversations; `paced=False` drops the delays.
+        """
+        self.metrics.increment("respond_queries")
+        events = astream_response(
+            lambda: self._retrieve(query, filter),
+            lambda results: self._build_response(query, results),
+            self.NO_ANSWER,
+            thinking_steps=(lambda results: self._generate_thinking_steps(query, results)) if show_thinking else None,
+            thinking_speed=self.thinking_speed, answer_speed=self.stream_speed, paced=paced,
+            metrics=self.metrics, executor=executor
+        )
+        async for event in events:
+            yield event
+    
     def _format_answer(self, query, content, title):
         if query.lower().startswith("what is") or query.lower().startswith("what are"):
             return content
@@ -95,6 +171,7 @@ class StreamingKnowledgeBase:
     def close(self):
         self.answer_streamer.stop()
         self.thinking_streamer.stop()
+        self.search_engine.close()
 
 
 if __name__ == "__main__":
@@ -301,11 +378,13 @@ if __name__ == "__main__":
     print("--------------------------------")
     print("Type 'quit' to exit")
     print("Type 'fast' to toggle thinking steps")
+    print("Type 'pipeline' to toggle preparing the answer while thinking")
     print()
     
     assistant = StreamingKnowledgeBase(knowledge_data)
     
     show_thinking = True
+    pipelined = False
     
     try:
         while True:
@@ -320,7 +399,12 @@ if __name__ == "__main__":
                 print(f"\nThinking steps {'enabled' if show_thinking else 'disabled'}")
                 continue
             
-            response_info = assistant.respond(query, show_thinking=show_thinking)
+            if query.lower() == "pipeline":
+                pipelined = not pipelined
+                print(f"\nPipelined answers {'enabled' if pipelined else 'disabled'}")
+                continue
+            
+            response_info = assistant.respond(query, show_thinking=show_thinking, pipelined=pipelined)
             
             assistant.answer_streamer.wait_until_done()
             
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from semantic_search import filter_key
+
+
+class MicroBatcher:
+    """Collects concurrent search calls into batched `search_batch` calls.
+
+    Requests are queued and a single thread drains whatever has arrived into
+    one vectorize-and-score pass of up to `max_batch` queries. A lone request
+    is dispatched straight away; only when the previous batch held more than
+    one query (i.e. under concurrent load) does the thread wait up to
+    `window` seconds for the batch to fill. Low-load latency therefore stays
+    that of a single search.
+
+    `search` has the same signature as `SimpleSemanticSearch.search`, so a
+    batcher can stand in for an assistant's `search_engine`.
+    """
+
+    _STOP = object()
+
+    def __init__(self, engine, max_batch=32, window=0.002):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.window = window
+        self.batches = 0
+        self.queries = 0
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="MicroBatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, query, top_k=5, min_score=None, filter=None):
+        future = Future()
+        self._requests.put((query, top_k, min_score, filter, future))
+        return future
+
+    def search(self, query, top_k=5, min_score=None, filter=None):
+        return self.submit(query, top_k, min_score, filter).result()
+
+    def _collect(self, first, wait):
+        batch = [first]
+        deadline = time.monotonic() + wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    request = self._requests.get(timeout=timeout)
+                else:
+                    request = self._requests.get(block=False)
+            except queue.Empty:
+                break
+            if request is self._STOP:
+                self._requests.put(self._STOP)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        last_size = 1
+        while True:
+            first = self._requests.get()
+            if first is self._STOP:
+                return
+            batch = self._collect(first, self.window if last_size > 1 else 0.0)
+            last_size = len(batch)
+
+            # Queries with different filters cannot share a search_batch call.
+            groups = {}
+            for request in batch:
+                groups.setdefault(filter_key(request[3]), []).append(request)
+            for group in groups.values():
+                self._search_group(group)
+            self.batches += 1
+            self.queries += len(batch)
+
+    def _search_group(self, batch):
+        # Rows are looked up under the engine's lock, so a compaction
+        # cannot renumber them between scoring and lookup.
+        with self.engine.lock:
+            try:
+                top_k = max(request[1] for request in batch)
+                indices, scores = self.engine.search_batch(
+                    [request[0] for request in batch], top_k=top_k, filter=batch[0][3]
+                )
+            except Exception as e:
+                for request in batch:
+                    request[4].set_exception(e)
+                return
+
+            batch_results = []
+            for (query, k, min_score, _, future), row_indices, row_scores in zip(batch, indices, scores):
+                results = []
+                for idx, score in zip(row_indices[:k], row_scores[:k]):
+                    if idx < 0 or (min_score is not None and score < min_score):
+                        break
+                    doc_id, doc_text = self.engine.documents[idx]
+                    results.append((doc_id, doc_text, score))
+                batch_results.append(results)
+
+        for request, results in zip(batch, batch_results):
+            request[4].set_result(results)
+
+    def close(self):
+        self._requests.put(self._STOP)
+        self._thread.join(timeout=1.0)
+        self.engine.close()
+
+
+def _to_json(value):
+    return json.dumps(value, default=float).encode("utf-8") + b"\n"
+
+
+class SearchService:
+    """Minimal asyncio HTTP/JSON front end for a knowledge-base assistant.
+
+    - `/search` (GET `?q=...&top_k=...` or POST `{"query": ..., "top_k": ...,
+      "filter": {"category": [...]}}`) streams one JSON line per hit.
+    - `/respond` (GET `?q=...` or POST `{"query": ..., "show_thinking": ...,
+      "paced": ..., "filter": ...}`) streams the `respond_async` events as
+      JSON lines.
+
+    Parameters are checked before the response starts, so a bad request
+    gets a 400 with a JSON error instead of a cut-off stream.
+
+    Responses use chunked transfer encoding over keep-alive connections.
+    The assistant's search engine is wrapped in a `MicroBatcher`, so
+    concurrent requests on both endpoints share batched scoring passes.
+    """
+
+    def __init__(self, assistant, max_batch=32, window=0.002, workers=64):
+        self.assistant = assistant
+        self.batcher = MicroBatcher(assistant.search_engine, max_batch=max_batch, window=window)
+        assistant.search_engine = self.batcher
+        # respond_async runs retrieval in this pool; each call blocks on the
+        # batcher, so its size bounds how many queries can share a batch.
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, version = request_line.decode("latin-1").split()
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        body = b""
+        length = int(headers.get("content-length", 0))
+        if length:
+            body = await reader.readexactly(length)
+        return method, target, version, headers, body
+
+    async def _send_json(self, writer, status, reason, payload):
+        body = _to_json(payload)
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def _send_stream(self, writer, items):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        async for item in items:
+            data = _to_json(item)
+            writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _search_events(self, query, top_k, filter=None):
+        results = await asyncio.wrap_future(self.batcher.submit(query, top_k, filter=filter))
+        for rank, (doc_id, text, score) in enumerate(results):
+            yield {"rank": rank, "id": doc_id, "text": text, "score": score}
+
+    async def _respond_events(self, query, show_thinking, paced, filter=None):
+        # Only assistants with metadata fields take a filter, and `_check_filter`
+        # rejects one for the others.
+        options = {"filter": filter} if filter else {}
+        events = self.assistant.respond_async(
+            query, show_thinking=show_thinking, paced=paced, executor=self.executor, **options
+        )
+        async for kind, payload in events:
+            yield {"type": kind, "data": payload}
+
+    def _parse_params(self, method, target, body):
+        url = urlsplit(target)
+        if method == "GET":
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if "q" in params:
+                params["query"] = params.pop("q")
+        else:
+            params = json.loads(body or b"{}")
+            if not isinstance(params, dict):
+                raise ValueError("request body must be a JSON object")
+        if not isinstance(params.get("query"), str):
+            raise ValueError("missing 'query'")
+
+        top_k = params.get("top_k", 5)
+        if isinstance(top_k, str):
+            top_k = int(top_k)
+        if not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 0:
+            raise ValueError("'top_k' must be a non-negative integer")
+        params["top_k"] = top_k
+        params["filter"] = self._check_filter(params.get("filter"))
+        return url.path, params
+
+    def _check_filter(self, filter):
+        if filter is None:
+            return None
+        if not isinstance(filter, dict):
+            raise ValueError("'filter' must be an object mapping field names to values")
+        fields = self.batcher.engine.documents.fields
+        for name, values in filter.items():
+            if name not in fields:
+                raise ValueError(f"unknown filter field {name!r}; this index has fields {sorted(fields)}")
+            if isinstance(values, str):
+                continue
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                raise ValueError(f"filter values for {name!r} must be a string or a list of strings")
+        return filter
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers, body = request
+
+                if method not in ("GET", "POST"):
+                    await self._send_json(writer, 405, "Method Not Allowed", {"error": "use GET or POST"})
+                else:
+                    try:
+                        path, params = self._parse_params(method, target, body)
+                    except (TypeError, AttributeError, ValueError) as e:
+                        await self._send_json(writer, 400, "Bad Request", {"error": str(e)})
+                    else:
+                        if path == "/search":
+                            events = self._search_events(params["query"], params["top_k"], params["filter"])
+                            await self._send_stream(writer, events)
+                        elif path == "/respond":
+                            show_thinking = params.get("show_thinking", False) in (True, "1", "true")
+                            paced = params.get("paced", False) in (True, "1", "true")
+                            events = self._respond_events(params["query"], show_thinking, paced, params["filter"])
+                            await self._send_stream(writer, events)
+                        else:
+                            await self._send_json(writer, 404, "Not Found", {"error": f"no route {path}"})
+
+                if headers.get("connection", "").lower() == "close" or version == "HTTP/1.0":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving /search and /respond on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.assistant.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a knowledge-base assistant over HTTP.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--alpaca", help="Alpaca dataset (JSON array or JSON Lines)")
+    source.add_argument("--knowledge", help="JSON list of {title, content, category} entries")
+    parser.add_argument("--index", help="index file to load or create (Alpaca only)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.alpaca:
+        from alpaca_search import AlpacaStreamingKnowledgeBase
+        assistant = AlpacaStreamingKnowledgeBase(args.alpaca, index_path=args.index)
+    else:
+        from search_applied import StreamingKnowledgeBase
+        with open(args.knowledge, 'r', encoding='utf-8') as f:
+            assistant = StreamingKnowledgeBase(json.load(f))
+
+    service = SearchService(assistant, max_batch=args.max_batch, window=args.window_ms / 1000)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
@@ -1,138 +1,983 @@
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import nltk
-from nltk.corpus import stopwords
-import time
+from scipy import sparse
+import asyncio
+import random
 import sys
+import re
 import threading
-import queue
-import random
+import time
+from contextlib import nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor, wait as wait_futures
+
+from document_store import DocumentStore
+from index_format import decode_strings, encode_strings, read_index, write_index
+from metrics import NULL_METRICS
+from parallel_build import count_terms_sharded, fit_transform, resolve_jobs
+from query_cache import QueryCache
+from stop_words import ENGLISH_STOP_WORDS
+from stream_scheduler import StreamScheduler
+from tfidf import build_analyzer, l2_normalize, smoothed_idf, transform
+
+_WORD_PATTERN = re.compile(r"\S+\s*|\s+")
+
+
+def _is_interactive(output):
+    try:
+        return output.isatty()
+    except (AttributeError, ValueError):
+        return False
+
 
 class TextStreamer:
-    """A simple text streaming class to mimic the behavior of TextStreamer in transformers."""
+    """A simple text streaming class to mimic the behavior of TextStreamer in transformers.
     
-    def __init__(self, output=sys.stdout, stream_interval=0.01):
+    `mode` controls pacing:
+    - "typewriter": one character per write, each followed by a short delay.
+    - "word": one word per write, delayed in proportion to its length, so the
+      pace matches "typewriter" with a fraction of the writes and flushes.
+    - "throughput": each chunk is written and flushed at once, with no delay.
+    The default picks "word" for terminals and "throughput" for pipes and files.
+    
+    A streamer is a handle on a `StreamScheduler`; all streamers share the
+    process-wide scheduler thread unless given their own. `max_pending`
+    bounds the queued characters, making `put` block until the stream
+    catches up.
+    """
+    
+    MODES = ("typewriter", "word", "throughput")
+    
+    def __init__(self, output=sys.stdout, stream_interval=0.01, mode=None, scheduler=None, max_pending=None):
+        if mode is None:
+            mode = "word" if _is_interactive(output) else "throughput"
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}, got {mode!r}")
+        
         self.output = output
         self.stream_interval = stream_interval
-        self.text_queue = queue.Queue()
+        self.mode = mode
+        self.max_pending = max_pending
+        self.scheduler = scheduler or StreamScheduler.default()
         self.streaming = False
-        self.stream_thread = None
-    
-    def _stream_text(self):
-        while self.streaming:
-            try:
-                text_chunk = self.text_queue.get(block=False)
-                for char in text_chunk:
-                    self.output.write(char)
-                    self.output.flush()
-                    # Randomize slightly for more natural feel
-                    delay = self.stream_interval * (0.5 + random.random())
-                    time.sleep(delay)
-                self.text_queue.task_done()
-            except queue.Empty:
-                time.sleep(0.01)
+        self._stream = self._open_stream()
+    
+    def _open_stream(self):
+        return self.scheduler.open_stream(
+            self.output, self.stream_interval, paced=self.mode != "throughput"
+        )
     
     def start(self):
+        if self._stream.flush_all:
+            self._stream = self._open_stream()
         self.streaming = True
-        self.stream_thread = threading.Thread(target=self._stream_text)
-        self.stream_thread.daemon = True
-        self.stream_thread.start()
     
     def stop(self):
         self.streaming = False
-        if self.stream_thread:
-            self.stream_thread.join(timeout=1.0)
+        self.scheduler.flush(self._stream)
+        self.scheduler.wait_idle(self._stream, timeout=1.0)
     
     def put(self, text):
-        self.text_queue.put(text)
+        if self.mode == "typewriter":
+            pieces = list(text)
+        elif self.mode == "word":
+            pieces = _WORD_PATTERN.findall(text)
+        else:
+            pieces = [text]
+        if pieces:
+            self.scheduler.submit(self._stream, pieces, self.max_pending)
     
     def wait_until_done(self):
-        self.text_queue.join()
+        self.scheduler.wait_idle(self._stream)
+    
+    def mark_next_write(self):
+        """Time the write of the next text `put` on this streamer; see `wait_marked_write`."""
+        self.scheduler.mark_next_write(self._stream)
+    
+    def wait_marked_write(self, timeout=None):
+        """`time.monotonic()` at which the marked text started being written (None on timeout)."""
+        return self.scheduler.wait_marked_write(self._stream, timeout)
 
 
-class SimpleSemanticSearch:
-    def __init__(self):
+async def astream_text(text, stream_interval=0.0):
+    """Async counterpart of a word-mode TextStreamer: yield `text` a word at a time.
+    
+    With a non-zero `stream_interval` each word is followed by an
+    `asyncio.sleep` proportional to its length, so pacing never blocks the
+    event loop.
+    """
+    for piece in _WORD_PATTERN.findall(text):
+        yield piece
+        if stream_interval:
+            await asyncio.sleep(stream_interval * len(piece) * (0.5 + random.random()))
+
+
+def filter_key(filter):
+    """Hashable, order-independent form of a search `filter`, for cache keys and grouping."""
+    if not filter:
+        return None
+    return tuple(sorted(
+        (name, (values,) if isinstance(values, str) else tuple(sorted(set(values))))
+        for name, values in filter.items()
+    ))
+
+
+def stream_response(thinking_streamer, answer_streamer, retrieve, build, no_answer, query_steps=(), result_steps=None,
+                    metrics=NULL_METRICS, pipelined=False, cut_thinking=False, started=None):
+    """Stream the thinking steps and then the answer for one query; returns `(info, seconds)`.
+    
+    `retrieve()` returns the search results, or None when nothing matched
+    (then `no_answer` is streamed and info is None), and `build(results)`
+    returns `(answer, info)`. `query_steps` are the thinking steps that do
+    not depend on the results and `result_steps(results)` gives the rest;
+    each step is followed by a short pause.
+    
+    By default the answer is retrieved and built first and all steps are
+    shown afterwards. With `pipelined=True` retrieval and formatting run on
+    another thread while `query_steps` are shown, and the answer is queued
+    the moment the last step has been written; with `cut_thinking` as well,
+    no further steps are shown once the answer is ready (the first always
+    is). In pipelined mode `seconds` is the time from `started` (a
+    `time.monotonic()` value, default now) until the first answer character
+    was written, also observed as the metrics stage
+    "time_to_first_answer_byte"; otherwise it is None.
+    """
+    if started is None:
+        started = time.monotonic()
+    
+    prepared = Future()
+    
+    def prepare():
         try:
-            nltk.data.find('corpora/stopwords')
-        except LookupError:
-            nltk.download('stopwords')
-            nltk.download('punkt')
-        
-        self.vectorizer = TfidfVectorizer(
-            stop_words=stopwords.words('english'),
-            lowercase=True,
-            norm='l2'
-        )
+            with metrics.timer("retrieve"):
+                results = retrieve()
+            response = None
+            if results is not None:
+                with metrics.timer("format"):
+                    response = build(results)
+            prepared.set_result((results, response))
+        except Exception as e:
+            prepared.set_exception(e)
+    
+    if pipelined:
+        threading.Thread(target=prepare, name="prepare-answer", daemon=True).start()
+    else:
+        prepare()
+    
+    shown = 0
+    
+    def show(steps, last):
+        nonlocal shown
+        for i, step in enumerate(steps):
+            if cut_thinking and shown and prepared.done():
+                return
+            if not shown:
+                print("\nThinking: ", end="")
+            thinking_streamer.put(step + "... ")
+            thinking_streamer.wait_until_done()
+            shown += 1
+            if pipelined and last and i == len(steps) - 1:
+                return
+            pause = 0.2 + random.random() * 0.3  # Random pause between steps
+            if cut_thinking:
+                wait_futures([prepared], timeout=pause)
+            else:
+                time.sleep(pause)
+    
+    thinking = metrics.timer("thinking") if query_steps or result_steps is not None else nullcontext()
+    with thinking:
+        if pipelined:
+            show(query_steps, last=False)
+        results, response = prepared.result()
+        if results is not None and result_steps is not None:
+            steps = result_steps(results)
+            show(steps if pipelined else list(query_steps) + steps, last=True)
+        if shown:
+            print("\n\nAnswer: ", end="")
+    
+    if results is None:
+        answer_streamer.put(no_answer)
+        return None, None
+    
+    answer, info = response
+    with metrics.timer("stream"):
+        if pipelined:
+            answer_streamer.mark_next_write()
+        answer_streamer.put(answer)
+    seconds = None
+    if pipelined and answer:
+        written = answer_streamer.wait_marked_write(timeout=5.0)
+        if written is not None:
+            seconds = written - started
+            metrics.observe("time_to_first_answer_byte", seconds)
+    return info, seconds
+
+
+async def astream_response(retrieve, build, no_answer, thinking_steps=None, thinking_speed=0.0, answer_speed=0.0,
+                           paced=True, metrics=NULL_METRICS, executor=None):
+    """Async counterpart of `stream_response`: yield `(kind, payload)` events for one query.
+    
+    `retrieve` runs in `executor` (the loop's default when None) and returns
+    the results or None; `build(results)` returns `(answer, info)` and
+    `thinking_steps(results)`, if given, the steps to show first. `kind` is
+    "thinking" or "answer" for text chunks and the last event is
+    `("result", info)`, with None (counted as "rejections") when nothing
+    matched. `paced=False` drops all delays.
+    """
+    if not paced:
+        thinking_speed = answer_speed = 0
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(executor, retrieve)
+    
+    if results is None:
+        metrics.increment("rejections")
+        async for chunk in astream_text(no_answer, answer_speed):
+            yield "answer", chunk
+        yield "result", None
+        return
+    
+    if thinking_steps is not None:
+        for step in thinking_steps(results):
+            async for chunk in astream_text(step + "... ", thinking_speed):
+                yield "thinking", chunk
+            if paced:
+                await asyncio.sleep(0.2 + random.random() * 0.3)
+    
+    answer, info = build(results)
+    async for chunk in astream_text(answer, answer_speed):
+        yield "answer", chunk
+    
+    yield "result", info
+
+
+class SimpleSemanticSearch:
+    """TF-IDF search over a growing document collection.
+    
+    Vectors match sklearn's `TfidfVectorizer`, but neither sklearn nor NLTK
+    is imported to fit or query (see `vectorizer`). `incremental` appends
+    new documents instead of refitting, `cache_size`/`cache_ttl` cache
+    `search` results, `n_jobs` shards fitting over worker processes (-1 for
+    all cores), `compact_threshold` governs compaction after `delete` and
+    `update`, `fields` names metadata columns for search filters, and
+    `metrics` (a `metrics.Metrics`) receives timings and counters.
+    """
+    
+    # A filter matching less than this fraction of the rows is scored by
+    # gathering those rows; a broader one by scoring all rows and masking.
+    # Copying the matching rows stays cheaper than masking a full score
+    # matrix until nearly all of them match.
+    FILTER_GATHER_RATIO = 0.9
+    
+    def __init__(self, stop_words=None, incremental=False, auto_refresh=True, cache_size=0, cache_ttl=None, n_jobs=1, metrics=None, compact_threshold=0.25, fields=()):
+        if stop_words is None:
+            stop_words = ENGLISH_STOP_WORDS
+        
+        self.stop_words = frozenset(stop_words)
+        self.vocabulary = None
+        self.idf = None
+        self._vectorizer = None
         
-        self.documents = []
+        self.documents = DocumentStore(fields=fields)
         self.document_vectors = None
+        # JSON-serializable notes saved with the index (e.g. what it was built from).
+        self.metadata = {}
+        self._value_rows = None
+        
+        self.incremental = incremental
+        self.n_jobs = n_jobs
+        self._count_executor = None
+        self.auto_refresh = auto_refresh
+        self._analyzer = build_analyzer(self.stop_words)
+        self._vocabulary = {}
+        self._document_frequency = np.zeros(0, dtype=np.int64)
+        self._term_counts = None
+        self._pending_counts = []
+        self._idf_stale = False
+        
+        self.generation = 0
+        self.query_cache = QueryCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.metrics = metrics or NULL_METRICS
+        
+        self.compact_threshold = compact_threshold
+        self.lock = threading.RLock()
+        self._tombstones = None
+        self._deleted_rows = np.empty(0, dtype=np.int64)
+        self._id_rows = None
+        self._compaction = None
+    
+    def add_documents(self, documents, ids=None, fields=None):
+        """Append `documents`, with optional `ids` and `fields={"name": [values]}`.
+        
+        By default the vectorizer is refitted on the whole corpus. With
+        `incremental` only the new documents are tokenized and document
+        frequencies are kept; `auto_refresh` re-weights the whole matrix
+        before the next search, otherwise older rows keep their weights
+        until `refresh()`.
+        """
+        documents = list(documents)
+        with self.lock:
+            start = len(self.documents)
+            self.documents.extend(ids, documents, **(fields or {}))
+            self.generation += 1
+            self._track_rows(start)
+            
+            if self.incremental:
+                self._append_counts(documents)
+            else:
+                self._update_vectors()
+    
+    def _track_rows(self, start):
+        # Keep the tombstone bitmap and id lookup in step with rows appended from `start`.
+        n_rows = len(self.documents)
+        if self._tombstones is not None:
+            self._tombstones = np.concatenate([self._tombstones, np.zeros(n_rows - start, dtype=bool)])
+        if self._id_rows is not None:
+            for row in range(start, n_rows):
+                self._id_rows[self.documents.id(row)] = row
+        if self._value_rows is not None:
+            self._index_values(self.documents, start, self._value_rows)
+        elif self.documents.fields:
+            self._value_index()
+    
+    @staticmethod
+    def _index_values(documents, start, index):
+        # Append rows from `start` to the per-field {value: sorted rows} index.
+        for name, column in documents.fields.items():
+            groups = {}
+            for row in range(start, len(column)):
+                groups.setdefault(column[row], []).append(row)
+            field_index = index.setdefault(name, {})
+            for value, rows in groups.items():
+                rows = np.asarray(rows, dtype=np.int64)
+                if value in field_index:
+                    rows = np.concatenate([field_index[value], rows])
+                field_index[value] = rows
+        return index
+    
+    def _value_index(self):
+        if self._value_rows is None:
+            self._value_rows = self._index_values(self.documents, 0, {})
+        return self._value_rows
     
-    def add_documents(self, documents, ids=None):
-        if ids is None:
-            start_idx = len(self.documents)
-            ids = list(range(start_idx, start_idx + len(documents)))
+    def _filter_rows(self, filter):
+        """Sorted live rows matching `filter` ({field: value or list of values}), or None without one.
         
-        self.documents.extend(list(zip(ids, documents)))
+        Values of one field are alternatives; different fields must all match.
+        """
+        if not filter:
+            return None
+        index = self._value_index()
+        rows = None
+        for name, values in filter.items():
+            if name not in index:
+                raise ValueError(f"unknown field {name!r}; this index has fields {sorted(index)}")
+            if isinstance(values, str):
+                values = [values]
+            parts = [index[name][value] for value in set(values) if value in index[name]]
+            if not parts:
+                matched = np.empty(0, dtype=np.int64)
+            elif len(parts) == 1:
+                matched = parts[0]
+            else:
+                matched = np.sort(np.concatenate(parts))
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        if len(self._deleted_rows):
+            rows = rows[~self._tombstones[rows]]
+        return rows
+    
+    def _row_of(self, doc_id):
+        if self._id_rows is None:
+            self._id_rows = {}
+            for row, row_id in enumerate(self.documents.ids()):
+                if self._tombstones is None or not self._tombstones[row]:
+                    self._id_rows[row_id] = row
+        return self._id_rows.get(doc_id)
+    
+    def _mark_deleted(self, rows):
+        if self._tombstones is None:
+            self._tombstones = np.zeros(len(self.documents), dtype=bool)
+        self._tombstones[rows] = True
+        self._deleted_rows = np.flatnonzero(self._tombstones)
+    
+    def delete(self, ids):
+        """Remove the documents with these ids; unknown ids are ignored. Returns how many were removed.
+        
+        Rows are only marked in a tombstone bitmap and masked at query time
+        (IDF weights keep counting them). Once more than `compact_threshold`
+        of the rows are tombstones, `compact(wait=False)` runs; with None
+        compaction is left to explicit `compact()` calls.
+        """
+        with self.lock:
+            rows = []
+            for doc_id in ids:
+                row = self._row_of(doc_id)
+                if row is not None:
+                    del self._id_rows[doc_id]
+                    rows.append(row)
+            if rows:
+                self._mark_deleted(rows)
+                self.generation += 1
+                self._maybe_compact()
+            return len(rows)
+    
+    def update(self, doc_id, text):
+        """Replace the text of document `doc_id`, keeping its id; raises KeyError if there is none.
         
-        self._update_vectors()
+        Without `incremental` the new row is vectorized against the current
+        vocabulary when it has no new terms (the IDF weights catch up at the
+        next compaction); otherwise the index is refitted, as
+        `add_documents` would, so the new terms are searchable.
+        """
+        with self.lock:
+            row = self._row_of(doc_id)
+            if row is None:
+                raise KeyError(doc_id)
+            self._mark_deleted([row])
+            fields = {name: [column[row]] for name, column in self.documents.fields.items()}
+            
+            vocabulary = self.vocabulary
+            if self.incremental or any(term not in vocabulary for term in self._analyzer(text)):
+                self.add_documents([text], ids=[doc_id], fields=fields)
+            else:
+                start = len(self.documents)
+                self.documents.extend([doc_id], [text], **fields)
+                self.generation += 1
+                self._track_rows(start)
+                self.document_vectors = self._append_vectors(self.document_vectors, self.transform([text]))
+            self._maybe_compact()
+    
+    @property
+    def deleted_ratio(self):
+        """Fraction of rows that are tombstones."""
+        return len(self._deleted_rows) / max(1, len(self.documents))
+    
+    def _maybe_compact(self):
+        if self.compact_threshold is not None and self.deleted_ratio > self.compact_threshold:
+            self.compact(wait=False)
+    
+    def compact(self, wait=True):
+        """Rebuild the index without tombstoned rows and swap it in.
+        
+        With `wait=False` the rebuild runs on a background thread, which is
+        returned; searches and updates carry on meanwhile and changes made
+        during the rebuild are carried over into the new index. Searches hold
+        `lock`, so they see either the old index or the new one. Only one
+        compaction runs at a time.
+        """
+        with self.lock:
+            if self._compaction is None or not self._compaction.is_alive():
+                self._compaction = threading.Thread(target=self._compact, name="compaction", daemon=True)
+                self._compaction.start()
+            thread = self._compaction
+        if wait:
+            thread.join()
+        return thread
+    
+    def _compact(self):
+        try:
+            with self.metrics.timer("compaction"):
+                self._rebuild_live()
+            self.metrics.increment("compactions")
+        except Exception as e:
+            print(f"Compaction failed: {e!r}", file=sys.stderr)
+    
+    def _rebuild_live(self):
+        with self.lock:
+            self._sync_vectors()
+            if self._tombstones is None:
+                return
+            n_rows = len(self.documents)
+            documents = self.documents
+            live_rows = np.flatnonzero(~self._tombstones)
+            term_counts = self._term_counts
+            fitted_vocabulary = self.vocabulary
+        
+        # The expensive part runs without the lock, on a snapshot of the first
+        # `n_rows` rows; appended rows never change earlier ones.
+        new_documents = documents.take(live_rows)
+        value_rows = self._index_values(new_documents, 0, {}) if new_documents.fields else None
+        if self.incremental:
+            counts = term_counts[live_rows]
+            frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+            idf = smoothed_idf(frequency, len(live_rows))
+            vectors = self._store_vectors(l2_normalize(counts.multiply(idf).tocsr()))
+        else:
+            vectors, vocabulary, idf = fit_transform(new_documents.texts, self.stop_words, self.n_jobs)
+            vectors = self._store_vectors(vectors)
+        extra = self._rebuild_extra(vectors, fitted_vocabulary if self.incremental else vocabulary)
+        
+        with self.lock:
+            new_rows = np.full(n_rows, -1, dtype=np.int64)
+            new_rows[live_rows] = np.arange(len(live_rows))
+            tombstones = self._tombstones
+            
+            # Rows added (by add_documents or update) while rebuilding.
+            tail = range(n_rows, len(self.documents))
+            new_documents.extend(
+                [self.documents.id(row) for row in tail], self.documents.texts[n_rows:],
+                **{name: column[n_rows:] for name, column in self.documents.fields.items()}
+            )
+            
+            if self.incremental:
+                self._sync_vectors()
+                n_terms = len(self._vocabulary)
+                tail_counts = self._term_counts[n_rows:]
+                counts.resize(counts.shape[0], n_terms)
+                frequency = np.concatenate([frequency, np.zeros(n_terms - len(frequency), dtype=frequency.dtype)])
+                frequency += np.bincount(tail_counts.indices, minlength=n_terms)
+                self._term_counts = sparse.vstack([counts, tail_counts], format='csr')
+                self._document_frequency = frequency
+                self.idf = smoothed_idf(frequency, len(new_documents))
+                if len(tail):
+                    # Older rows keep the snapshot's weights until the next refresh.
+                    tail_vectors = l2_normalize(tail_counts.multiply(self.idf).tocsr())
+                    vectors = self._append_vectors(vectors, tail_vectors)
+                self._idf_stale = bool(len(tail))
+                self.document_vectors = vectors
+            elif self.vocabulary is not fitted_vocabulary:
+                # add_documents refitted meanwhile; refit again so its terms are kept.
+                self.documents = new_documents
+                self._update_vectors()
+                extra = None
+            else:
+                self.vocabulary = vocabulary
+                self.idf = idf
+                if len(tail):
+                    vectors = self._append_vectors(vectors, self.transform(self.documents.texts[n_rows:]))
+                self.document_vectors = vectors
+            self.documents = new_documents
+            self._swap_extra(extra)
+            
+            # Deletions made while rebuilding, mapped to the new rows.
+            late = np.flatnonzero(tombstones[:n_rows] & (new_rows >= 0))
+            self._tombstones = None
+            self._deleted_rows = np.empty(0, dtype=np.int64)
+            deleted = np.concatenate([new_rows[late], np.flatnonzero(tombstones[n_rows:]) + len(live_rows)])
+            if len(deleted):
+                self._mark_deleted(deleted)
+            self._id_rows = None
+            self._value_rows = value_rows
+            if value_rows is not None:
+                self._index_values(new_documents, len(live_rows), value_rows)
+            self.generation += 1
+    
+    @property
+    def vectorizer(self):
+        """A `TfidfVectorizer` fitted like this engine (imports sklearn on first use).
+        
+        The engine keeps its own fitted `vocabulary` and `idf` and uses the
+        bundled `ENGLISH_STOP_WORDS` by default, so loading a saved index
+        needs neither sklearn nor NLTK.
+        """
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            self._vectorizer = TfidfVectorizer(stop_words=sorted(self.stop_words), lowercase=True, norm='l2')
+        if self.idf is not None:
+            self._vectorizer.vocabulary_ = self.vocabulary
+            self._vectorizer.idf_ = self.idf
+        return self._vectorizer
+    
+    def transform(self, queries):
+        """TF-IDF rows for `queries`, as `vectorizer.transform` would compute them."""
+        return transform(queries, self._analyzer, self.vocabulary, self.idf)
     
     def _update_vectors(self):
-        texts = [doc[1] for doc in self.documents]
-        self.document_vectors = self.vectorizer.fit_transform(texts)
+        vectors, self.vocabulary, self.idf = fit_transform(
+            self.documents.texts, self.stop_words, self.n_jobs
+        )
+        self.document_vectors = self._store_vectors(vectors)
+    
+    def _store_vectors(self, vectors):
+        """Hook for subclasses to convert a freshly built float64 CSR matrix to their storage."""
+        return vectors
+    
+    def _append_vectors(self, vectors, new_vectors):
+        """Hook for subclasses: stored `vectors` with the float64 CSR rows `new_vectors` appended."""
+        vectors.resize(vectors.shape[0], new_vectors.shape[1])
+        return sparse.vstack([vectors, new_vectors], format='csr')
+    
+    def _count_pool(self):
+        # Kept across incremental adds, so batches do not pay for starting workers.
+        if resolve_jobs(self.n_jobs) == 1:
+            return None
+        if self._count_executor is None:
+            self._count_executor = ProcessPoolExecutor(max_workers=resolve_jobs(self.n_jobs))
+        return self._count_executor
+    
+    def _append_counts(self, documents):
+        counts = count_terms_sharded(documents, self.stop_words, self._vocabulary, self.n_jobs, self._count_pool())
+        
+        frequency = np.bincount(counts.indices, minlength=len(self._vocabulary))
+        frequency[:len(self._document_frequency)] += self._document_frequency
+        self._document_frequency = frequency
+        
+        self._pending_counts.append(counts)
+        self._idf_stale = True
+    
+    def _restore_counts(self):
+        # The file only holds weighted vectors; recount the texts against the
+        # loaded vocabulary so later appends and re-weighting see every row.
+        self._vocabulary = self.vocabulary
+        self._term_counts = count_terms_sharded(
+            self.documents.texts, self.stop_words, self._vocabulary, self.n_jobs, self._count_pool()
+        )
+        self._document_frequency = np.bincount(self._term_counts.indices, minlength=len(self._vocabulary))
+        self._pending_counts = []
+        self._idf_stale = False
+    
+    def _compute_idf(self):
+        return smoothed_idf(self._document_frequency, len(self.documents))
+    
+    def _sync_vectors(self, refresh=False):
+        if not self.incremental:
+            return
+        reweight = self._idf_stale and (refresh or self.auto_refresh)
+        if not self._pending_counts and not reweight:
+            return
+        
+        if not self._vocabulary:
+            raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+        
+        n_terms = len(self._vocabulary)
+        blocks = self._pending_counts
+        self._pending_counts = []
+        for block in blocks:
+            block.resize(block.shape[0], n_terms)
+        
+        new_counts = sparse.vstack(blocks, format='csr') if blocks else None
+        if self._term_counts is None:
+            self._term_counts = new_counts
+        elif new_counts is not None:
+            self._term_counts.resize(self._term_counts.shape[0], n_terms)
+            self._term_counts = sparse.vstack([self._term_counts, new_counts], format='csr')
+        
+        idf = self._compute_idf()
+        self.vocabulary = self._vocabulary
+        self.idf = idf
+        
+        if reweight or self.document_vectors is None:
+            self.document_vectors = self._store_vectors(l2_normalize(self._term_counts.multiply(idf).tocsr()))
+            self._idf_stale = False
+        elif new_counts is not None:
+            new_vectors = l2_normalize(new_counts.multiply(idf).tocsr())
+            self.document_vectors = self._append_vectors(self.document_vectors, new_vectors)
+    
+    def refresh(self):
+        """Recompute IDF weights for every row of an incremental index."""
+        with self.lock:
+            if self._idf_stale:
+                self.generation += 1
+            self._sync_vectors(refresh=True)
     
-    def search(self, query, top_k=5):
-        query_vector = self.vectorizer.transform([query])
+    def search(self, query, top_k=5, min_score=None, filter=None):
+        """Top `top_k` `(id, text, score)` matches for `query`.
         
-        similarities = cosine_similarity(query_vector, self.document_vectors)[0]
+        `filter` ({field: value or list of values}) restricts the search to
+        matching documents; results are never cut short by the others. With
+        a cache, results are keyed on the normalized query and invalidated
+        by every change to the index (`generation`).
+        """
+        metrics = self.metrics
+        metrics.increment("search_queries")
         
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        with metrics.timer("search"), self.lock:
+            if self.query_cache is None:
+                return self._search(query, top_k, min_score, filter)
+            
+            generation = self.generation
+            key = (" ".join(query.lower().split()), top_k, min_score, filter_key(filter))
+            results = self.query_cache.get(key, generation)
+            if results is None:
+                metrics.increment("cache_misses")
+                results = self._search(query, top_k, min_score, filter)
+                self.query_cache.put(key, results, generation)
+            else:
+                metrics.increment("cache_hits")
+            return list(results)
+    
+    def _search(self, query, top_k, min_score, filter=None):
+        indices, scores = self.search_batch([query], top_k=top_k, filter=filter)
         
         results = []
-        for idx in top_indices:
+        for idx, score in zip(indices[0], scores[0]):
+            if idx < 0 or (min_score is not None and score < min_score):
+                break
             doc_id, doc_text = self.documents[idx]
-            score = similarities[idx]
             results.append((doc_id, doc_text, score))
         
         return results
+    
+    def search_batch(self, queries, top_k=5, batch_size=256, filter=None):
+        """Score many queries at once.
+        
+        All queries are vectorized in one `transform` call and scored against
+        the corpus with a sparse matrix product, `batch_size` queries at a
+        time to bound the dense score buffer. Returns `(indices, scores)`
+        arrays of shape `(len(queries), k)`, best match first, where
+        `k = min(top_k, len(documents))`; indices are row positions in
+        `documents`. Rows are padded with index -1 and score -inf when fewer
+        than `k` documents are live. With a `filter` (see `_filter_rows`)
+        only matching documents are ranked, and `k` is at most their number.
+        
+        Hold `lock` while looking the rows up in `documents`, or a
+        compaction may renumber them in between.
+        """
+        with self.lock:
+            return self._search_batch(queries, top_k, batch_size, filter)
+    
+    def _search_batch(self, queries, top_k, batch_size, filter=None):
+        self._sync_vectors()
+        rows = self._filter_rows(filter)
+        
+        n_documents = 0 if self.document_vectors is None else self.document_vectors.shape[0]
+        k = min(top_k, n_documents if rows is None else len(rows))
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float64)
+        if k == 0 or not len(queries):
+            return indices, scores
+        
+        with self.metrics.timer("transform"):
+            query_vectors = self.transform(queries)
+        self._rank_batches(query_vectors, rows, k, batch_size, indices, scores)
+        return indices, scores
+    
+    def _rank_batches(self, query_vectors, rows, k, batch_size, indices, scores):
+        """Hook for subclasses: fill `indices` and `scores` with each query's top `k` rows.
+        
+        `rows` are the sorted live rows matching the filter, or None for all
+        live rows. Slots without a result keep -1 and -inf.
+        """
+        n_documents = self.document_vectors.shape[0]
+        gather = rows is not None and self._gather_rows(rows, n_documents)
+        metrics = self.metrics
+        for start in range(0, query_vectors.shape[0], batch_size):
+            stop = start + batch_size
+            with metrics.timer("similarity"):
+                if gather:
+                    batch_scores = self._score_rows(query_vectors[start:stop], rows)
+                else:
+                    batch_scores = self._score(query_vectors[start:stop])
+            with metrics.timer("rank"):
+                if rows is None:
+                    self._mask_deleted(batch_scores)
+                elif not gather:
+                    self._mask_unmatched(batch_scores, rows)
+                top, scores[start:stop] = self._select_top_k(batch_scores, k)
+                indices[start:stop] = rows[top] if gather else top
+        
+        if len(self._deleted_rows):
+            indices[scores == -np.inf] = -1
+    
+    def _gather_rows(self, rows, n_documents):
+        return len(rows) < self.FILTER_GATHER_RATIO * n_documents
+    
+    @staticmethod
+    def _mask_unmatched(scores, rows):
+        unmatched = np.ones(scores.shape[1], dtype=bool)
+        unmatched[rows] = False
+        scores[:, unmatched] = -np.inf
+    
+    def _mask_deleted(self, scores):
+        """Set the columns of tombstoned rows in a dense `(n_queries, n_rows)` score array to -inf."""
+        if len(self._deleted_rows):
+            scores[:, self._deleted_rows] = -np.inf
+    
+    def _score(self, query_vectors):
+        # Rows of both matrices are already L2-normalized, so the dot
+        # product is the cosine similarity.
+        return (query_vectors @ self.document_vectors.T).toarray()
+    
+    def _score_rows(self, query_vectors, rows):
+        """Like `_score`, but only against `rows`: a `(n_queries, len(rows))` array."""
+        return (query_vectors @ self.document_vectors[rows].T).toarray()
+    
+    @staticmethod
+    def _select_top_k(scores, k):
+        n_rows, n_columns = scores.shape
+        if k < n_columns:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(n_columns), (n_rows, n_columns))
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind='stable')
+        return (
+            np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(candidate_scores, order, axis=1)
+        )
+    
+    def memory_usage(self):
+        """Bytes held by the index arrays, by component."""
+        with self.lock:
+            self._sync_vectors()
+            usage = {}
+            if self.document_vectors is not None:
+                vectors = self.document_vectors
+                usage["sparse_matrix_bytes"] = vectors.data.nbytes + vectors.indices.nbytes + vectors.indptr.nbytes
+            usage["document_store_bytes"] = self.documents.nbytes
+            return usage
+    
+    def save(self, path):
+        """Write the fitted index to a single versioned binary file at `path`."""
+        with self.lock:
+            self._save(path)
+    
+    def _save(self, path):
+        self._sync_vectors(refresh=True)
+        if self.document_vectors is None:
+            raise ValueError("Cannot save an empty index; add documents first")
+        
+        vocabulary = sorted(self.vocabulary.items(), key=lambda item: item[1])
+        vocab_blob, vocab_offsets = encode_strings([term for term, _ in vocabulary])
+        arrays, meta = self.documents.to_arrays()
+        
+        vectors = self.document_vectors.tocsr()
+        arrays.update({
+            "idf": self.idf,
+            "vocab_blob": vocab_blob,
+            "vocab_offsets": vocab_offsets,
+            "data": vectors.data,
+            "indices": vectors.indices,
+            "indptr": vectors.indptr,
+        })
+        if self._tombstones is not None:
+            arrays["tombstones"] = self._tombstones
+        meta.update({
+            "stop_words": sorted(self.stop_words),
+            "shape": list(vectors.shape),
+            "metadata": self.metadata,
+        })
+        self._save_extra(arrays, meta)
+        write_index(path, arrays, meta)
+    
+    def _save_extra(self, arrays, meta):
+        """Hook for subclasses to add their own arrays and meta entries to `save`."""
+    
+    def _rebuild_extra(self, vectors, vocabulary):
+        """Hook for subclasses: state derived from a compaction's `vectors`, built without holding `lock`.
+        
+        The columns of `vectors` follow `vocabulary`; rows added during the
+        compaction are not included.
+        """
+        return None
+    
+    def _swap_extra(self, extra):
+        """Hook for subclasses: install `_rebuild_extra`'s result as the compaction swaps in (None if it was discarded)."""
+    
+    def _load_extra(self, meta, arrays):
+        """Hook for subclasses to restore what `_save_extra` wrote."""
+    
+    @classmethod
+    def load(cls, path, mmap=True, **kwargs):
+        """Load an index written by `save`; `kwargs` go to the constructor.
+        
+        With `mmap=True` the matrix arrays stay memory-mapped, so worker
+        processes serving the same file share one copy of it, document text
+        included, in the page cache. With `incremental=True` the stored
+        texts are re-tokenized to recover the term counts it appends to.
+        """
+        meta, arrays = read_index(path, mmap=mmap)
+        
+        engine = cls(stop_words=meta["stop_words"], **kwargs)
+        engine.metadata = dict(meta.get("metadata", {}))
+        vocabulary = decode_strings(arrays["vocab_blob"], arrays["vocab_offsets"])
+        engine.vocabulary = {term: i for i, term in enumerate(vocabulary)}
+        engine.idf = np.asarray(arrays["idf"])
+        
+        engine.document_vectors = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(meta["shape"]),
+            copy=False
+        )
+        
+        # Document text stays in the (memory-mapped) file and is decoded per hit.
+        # Field value indexes are rebuilt on the first filtered search.
+        engine.documents = DocumentStore.from_arrays(meta, arrays)
+        if "tombstones" in arrays:
+            engine._mark_deleted(np.flatnonzero(arrays["tombstones"]))
+        if engine.incremental:
+            engine._restore_counts()
+        engine._load_extra(meta, arrays)
+        
+        return engine
+    
+    def close(self):
+        if self._count_executor is not None:
+            self._count_executor.shutdown()
+            self._count_executor = None
 
 
 class StreamingFAQChatbot:
     
-    def __init__(self, faq_data, confidence_threshold=0.3, stream_speed=0.03):
+    def __init__(self, faq_data, confidence_threshold=0.3, stream_speed=0.03, search_engine_cls=SimpleSemanticSearch, metrics=None):
         self.faq_data = faq_data
         self.confidence_threshold = confidence_threshold
 
         self.questions = [item["question"] for item in faq_data]
         self.answers = [item["answer"] for item in faq_data]
         
-        self.search_engine = SimpleSemanticSearch()
+        self.metrics = metrics or NULL_METRICS
+        self.search_engine = search_engine_cls()
+        self.search_engine.metrics = self.metrics
         self.search_engine.add_documents(self.questions)
         
         self.streamer = TextStreamer(stream_interval=stream_speed)
         self.streamer.start()
     
-    def respond(self, query):
-        results = self.search_engine.search(query, top_k=1)
-        
+    def _candidates(self, query, min_score=None):
+        return self.search_engine.search(query, top_k=1, min_score=min_score)
+    
+    def _relevant(self, results):
         if not results or results[0][2] < self.confidence_threshold:
-            response = "I'm sorry, I don't understand your question. Could you rephrase it?"
-            self.streamer.put(response)
             return None
-        
+        return results
+    
+    def _retrieve(self, query):
+        return self._relevant(self._candidates(query, self.confidence_threshold))
+    
+    def _build_response(self, results):
         doc_id, matched_question, score = results[0]
-        
         answer = self.answers[doc_id]
-        self.streamer.put(answer)
-        
-        return {
+        return answer, {
             "matched_question": matched_question,
             "confidence": score,
             "answer": answer
         }
     
+    def respond(self, query):
+        metrics = self.metrics
+        metrics.increment("respond_queries")
+        
+        with metrics.timer("respond"):
+            with metrics.timer("retrieve"):
+                results = self._retrieve(query)
+            
+            if results is None:
+                metrics.increment("rejections")
+                response = "I'm sorry, I don't understand your question. Could you rephrase it?"
+                self.streamer.put(response)
+                return None
+            
+            answer, response_info = self._build_response(results)
+            with metrics.timer("stream"):
+                self.streamer.put(answer)
+            
+            return response_info
+    
+    def respond_quiet(self, query):
+        """`respond` without streaming: returns `(results, info)`.
+        
+        When nothing matches well enough info is None and results are the
+        hits that fell below `confidence_threshold`.
+        """
+        self.metrics.increment("respond_queries")
+        candidates = self._candidates(query)
+        results = self._relevant(candidates)
+        if results is None:
+            self.metrics.increment("rejections")
+            return candidates, None
+        return results, self._build_response(results)[1]
+    
     def close(self):
         self.streamer.stop()
+        self.search_engine.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import heapq
+import multiprocessing
+import os
+
+import numpy as np
+from scipy import sparse
+
+from semantic_search import SimpleSemanticSearch
+
+
+def _shard_worker(conn):
+    vectors = None
+    while True:
+        message = conn.recv()
+        command = message[0]
+        if command == "close":
+            break
+        try:
+            if command == "load":
+                _, data, indices, indptr, shape = message
+                vectors = sparse.csr_matrix((data, indices, indptr), shape=shape)
+                conn.send(("ok", None))
+            elif command == "search":
+                _, data, indices, indptr, shape, top_k, rows = message
+                queries = sparse.csr_matrix((data, indices, indptr), shape=shape)
+                gather = rows is not None and len(rows) < SimpleSemanticSearch.FILTER_GATHER_RATIO * vectors.shape[0]
+                if gather:
+                    scores = (queries @ vectors[rows].T).toarray()
+                else:
+                    scores = (queries @ vectors.T).toarray()
+                    if rows is not None:
+                        SimpleSemanticSearch._mask_unmatched(scores, rows)
+                k = min(top_k, vectors.shape[0] if rows is None else len(rows))
+                top, top_scores = SimpleSemanticSearch._select_top_k(scores, k)
+                conn.send(("ok", (rows[top] if gather else top, top_scores)))
+            else:
+                conn.send(("error", f"unknown command {command!r}"))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+    conn.close()
+
+
+class ShardedSemanticSearch(SimpleSemanticSearch):
+    """SimpleSemanticSearch that scatters scoring across worker processes.
+
+    The vectorizer is fitted on the whole corpus in this process, so IDF
+    weights are global and scores from different shards are comparable. The
+    rows of the resulting matrix are split into `n_shards` contiguous blocks,
+    each held by its own worker process; queries are sent to every shard at
+    once and the per-shard top-k lists are merged with a heap. Shards are
+    (re)loaded whenever the index changes. Call `close()` to stop the workers.
+    """
+
+    def __init__(self, *args, n_shards=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_shards = n_shards or os.cpu_count() or 1
+        self._workers = []
+        self._shard_offsets = []
+        self._distributed_vectors = None
+
+    def _start_workers(self, count):
+        context = multiprocessing.get_context()
+        while len(self._workers) < count:
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(child_conn,), daemon=True)
+            process.start()
+            child_conn.close()
+            self._workers.append((process, parent_conn))
+
+    def _call_all(self, messages):
+        connections = [conn for _, conn in self._workers[:len(messages)]]
+        for conn, message in zip(connections, messages):
+            conn.send(message)
+        replies = [conn.recv() for conn in connections]
+        for status, payload in replies:
+            if status != "ok":
+                raise RuntimeError(f"Search shard failed: {payload}")
+        return [payload for _, payload in replies]
+
+    def _distribute(self):
+        vectors = self.document_vectors.tocsr()
+        n_rows = vectors.shape[0]
+        n_shards = max(1, min(self.n_shards, n_rows))
+        bounds = np.linspace(0, n_rows, n_shards + 1).astype(int)
+
+        self._start_workers(n_shards)
+        messages = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            block = vectors[start:stop]
+            messages.append(("load", block.data, block.indices, block.indptr, block.shape))
+        self._call_all(messages)
+
+        self._shard_offsets = bounds[:-1].tolist()
+        self._distributed_vectors = self.document_vectors
+
+    def _rank_batches(self, query_vectors, rows, k, batch_size, indices, scores):
+        n_documents = self.document_vectors.shape[0]
+        if self._distributed_vectors is not self.document_vectors:
+            self._distribute()
+
+        # Shards do not know about tombstones, so ask for enough extra rows
+        # to fill k after dropping deleted ones. Filtered rows are live
+        # already and go to each shard in its own numbering.
+        shard_k = k + len(self._deleted_rows)
+        shard_rows = [None] * len(self._shard_offsets)
+        if rows is not None:
+            shard_k = k
+            cuts = np.searchsorted(rows, self._shard_offsets + [n_documents])
+            shard_rows = [
+                rows[begin:end] - offset
+                for begin, end, offset in zip(cuts[:-1], cuts[1:], self._shard_offsets)
+            ]
+        metrics = self.metrics
+        for start in range(0, query_vectors.shape[0], batch_size):
+            batch = query_vectors[start:start + batch_size]
+            messages = [
+                ("search", batch.data, batch.indices, batch.indptr, batch.shape, shard_k, local_rows)
+                for local_rows in shard_rows
+            ]
+            with metrics.timer("similarity"):
+                shard_results = self._call_all(messages)
+
+            with metrics.timer("rank"):
+                self._merge(shard_results, start, k, indices, scores)
+
+    def _merge(self, shard_results, start, k, indices, scores):
+        n_rows = len(shard_results[0][0])
+        for row in range(n_rows):
+            ranked = [
+                zip(shard_scores[row], shard_rows[row] + offset)
+                for (shard_rows, shard_scores), offset in zip(shard_results, self._shard_offsets)
+            ]
+            merged = heapq.merge(*ranked, key=lambda item: -item[0])
+            if len(self._deleted_rows):
+                merged = (item for item in merged if not self._tombstones[item[1]])
+            for column, (score, index) in zip(range(k), merged):
+                indices[start + row, column] = index
+                scores[start + row, column] = score
+
+    def close(self):
+        with self.lock:
+            for process, conn in self._workers:
+                try:
+                    conn.send(("close",))
+                except (BrokenPipeError, OSError):
+                    pass
+                conn.close()
+            for process, _ in self._workers:
+                process.join(timeout=1.0)
+                if process.is_alive():
+                    process.terminate()
+            self._workers = []
+            self._distributed_vectors = None
+        super().close()
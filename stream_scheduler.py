@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+
+class _Stream:
+    def __init__(self, output, interval, paced):
+        self.output = output
+        self.interval = interval
+        self.paced = paced
+        self.pending = deque()
+        self.pending_chars = 0
+        self.busy = False
+        self.flush_all = False
+        # Sequence number of this stream's live heap entry, if any.
+        self.token = None
+        # Earliest time the next piece may be written (pacing after the last write).
+        self.next_due = 0.0
+        # Characters ever queued and ever handed to `output.write`, so a
+        # marked character's write can be timed (see `mark_next_write`).
+        self.submitted = 0
+        self.written = 0
+        self.mark = None
+        self.mark_time = None
+
+
+class StreamScheduler:
+    """Drives any number of text streams from a single thread.
+
+    Each stream holds a queue of pieces (characters, words or whole chunks).
+    The scheduler keeps a heap of per-stream next-emit deadlines, sleeps until
+    the earliest one, writes one piece and re-schedules that stream after its
+    own pacing delay. Streams with nothing queued cost nothing, and the thread
+    blocks on a condition when every stream is idle.
+
+    Most callers share the process-wide instance from `StreamScheduler.default()`.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._thread = None
+
+    @classmethod
+    def default(cls):
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def open_stream(self, output, interval, paced=True):
+        return _Stream(output, interval, paced)
+
+    def _ensure_running(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="StreamScheduler", daemon=True)
+            self._thread.start()
+
+    def _schedule(self, stream, deadline):
+        stream.token = next(self._sequence)
+        heapq.heappush(self._heap, (deadline, stream.token, stream))
+
+    def submit(self, stream, pieces, max_pending=None):
+        """Queue pieces on `stream`, blocking while it already holds `max_pending` characters."""
+        with self._condition:
+            if max_pending:
+                self._condition.wait_for(
+                    lambda: stream.pending_chars < max_pending or stream.flush_all
+                )
+            chars = sum(len(piece) for piece in pieces)
+            stream.pending.extend(pieces)
+            stream.pending_chars += chars
+            stream.submitted += chars
+            if stream.token is None and not stream.busy:
+                self._schedule(stream, max(time.monotonic(), stream.next_due))
+            self._ensure_running()
+            self._condition.notify_all()
+
+    def flush(self, stream):
+        """Write everything queued on `stream` as soon as possible, without pacing."""
+        with self._condition:
+            stream.flush_all = True
+            if stream.pending and not stream.busy:
+                self._schedule(stream, max(time.monotonic(), stream.next_due))
+            self._ensure_running()
+            self._condition.notify_all()
+
+    def mark_next_write(self, stream):
+        """Remember when the next character submitted to `stream` starts being written."""
+        with self._condition:
+            stream.mark = stream.submitted
+            stream.mark_time = None
+
+    def wait_marked_write(self, stream, timeout=None):
+        """Block until the marked character is written; returns its `time.monotonic()` write time, or None on timeout."""
+        with self._condition:
+            self._condition.wait_for(lambda: stream.mark_time is not None, timeout)
+            return stream.mark_time
+
+    def wait_idle(self, stream, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not stream.pending and not stream.busy, timeout
+            )
+
+    def _next_piece(self):
+        with self._condition:
+            while True:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                deadline, token, stream = self._heap[0]
+                if token != stream.token:
+                    heapq.heappop(self._heap)
+                    continue
+
+                now = time.monotonic()
+                if deadline > now:
+                    self._condition.wait(deadline - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                stream.token = None
+                if not stream.pending:
+                    continue
+
+                if stream.flush_all or not stream.paced:
+                    text = "".join(stream.pending)
+                    stream.pending.clear()
+                else:
+                    text = stream.pending.popleft()
+                stream.pending_chars -= len(text)
+                if stream.mark is not None and stream.written <= stream.mark < stream.written + len(text):
+                    stream.mark_time = now
+                stream.written += len(text)
+                stream.busy = True
+                self._condition.notify_all()
+                return stream, text
+
+    def _run(self):
+        while True:
+            stream, text = self._next_piece()
+            try:
+                stream.output.write(text)
+                stream.output.flush()
+            except (OSError, ValueError):
+                pass
+
+            delay = 0.0
+            if stream.paced and not stream.flush_all:
+                # Randomize slightly for more natural feel
+                delay = stream.interval * len(text) * (0.5 + random.random())
+
+            with self._condition:
+                stream.busy = False
+                # Recorded even when nothing is queued, so a piece submitted
+                # later still waits out this one's delay.
+                stream.next_due = time.monotonic() + delay
+                if stream.pending:
+                    self._schedule(stream, stream.next_due)
+                self._condition.notify_all()
@@ -0,0 +1,37 @@
+import pytest
+
+from ann_index import IVFSemanticSearch
+from dense_index import DenseSemanticSearch
+
+TOPICS = ["password reset login", "payment card refund", "shipping delivery parcel", "router wifi firmware"]
+DOCUMENTS = [f"{TOPICS[i % 4]} note {i} {TOPICS[(i * 7) % 4].split()[i % 3]}" for i in range(200)]
+
+
+def _engine(engine_cls):
+    if engine_cls is IVFSemanticSearch:
+        return engine_cls(n_components=16, n_lists=8, nprobe=8, compact_threshold=None)
+    return engine_cls(n_components=16, compact_threshold=None)
+
+
+@pytest.mark.parametrize("engine_cls", [DenseSemanticSearch, IVFSemanticSearch])
+def test_update_projects_rows_without_refitting(engine_cls, monkeypatch):
+    engine = _engine(engine_cls)
+    engine.add_documents(DOCUMENTS)
+    engine.search("password")
+
+    fits = []
+    fit_projection = engine._fit_projection
+    monkeypatch.setattr(engine, "_fit_projection", lambda *args: fits.append(True) or fit_projection(*args))
+
+    engine.update(5, DOCUMENTS[100])
+    engine.add_documents(["shipping parcel delivery late"])
+    results = engine.search(DOCUMENTS[100], top_k=2)
+    assert fits == []
+    assert {doc_id for doc_id, _, _ in results} == {5, 100}
+    assert engine.dense_vectors.shape[0] == engine.document_vectors.shape[0]
+
+    engine.delete(range(0, 200, 2))
+    engine.compact()
+    assert fits == [True]
+    assert engine.search("router wifi", top_k=1)
+    engine.close()
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from inverted_index import InvertedIndexSearch
+from quantized_index import QuantizedSemanticSearch
+from semantic_search import SimpleSemanticSearch
+
+DOCUMENTS = [
+    "How do I reset my password?",
+    "Reset the router to factory settings",
+    "Change your account email address",
+    "Bake sourdough bread at home",
+]
+
+
+@pytest.mark.parametrize("engine_cls", [SimpleSemanticSearch, QuantizedSemanticSearch, InvertedIndexSearch])
+def test_load_incremental_then_add_matches_fresh_build(tmp_path, engine_cls):
+    path = str(tmp_path / "index.ssidx")
+    engine = engine_cls(incremental=True)
+    engine.add_documents(DOCUMENTS)
+    engine.save(path)
+
+    loaded = engine_cls.load(path, incremental=True)
+    loaded.add_documents(["Whole wheat bread recipe", "Router firmware update"])
+    loaded.update(2, "Change your account email or phone number")
+
+    fresh = engine_cls(incremental=True)
+    fresh.add_documents(DOCUMENTS)
+    fresh.add_documents(["Whole wheat bread recipe", "Router firmware update"])
+    fresh.update(2, "Change your account email or phone number")
+
+    for query in ["bread", "router reset", "phone number", "password"]:
+        results = loaded.search(query, top_k=3)
+        expected = fresh.search(query, top_k=3)
+        assert [doc_id for doc_id, _, _ in results] == [doc_id for doc_id, _, _ in expected]
+        assert np.allclose([score for _, _, score in results], [score for _, _, score in expected])
+
+    loaded.compact()
+    assert loaded.search("bread", top_k=2)
+
+
+def _corpus(n_docs=60, seed=0):
+    rng = np.random.default_rng(seed)
+    words = [f"term{i}" for i in range(80)]
+    return [" ".join(rng.choice(words, size=rng.integers(3, 12))) for _ in range(n_docs)]
+
+
+@pytest.mark.parametrize("auto_refresh", [True, False])
+@pytest.mark.parametrize("engine_cls", [SimpleSemanticSearch, QuantizedSemanticSearch, InvertedIndexSearch])
+def test_incremental_adds_rank_like_a_full_refit(engine_cls, auto_refresh):
+    documents = _corpus()
+    queries = _corpus(20, seed=1)
+
+    incremental = engine_cls(incremental=True, auto_refresh=auto_refresh)
+    for start in range(0, len(documents), 7):
+        incremental.add_documents(documents[start:start + 7])
+        # Searching in between syncs each batch on its own.
+        incremental.search(queries[0])
+    if not auto_refresh:
+        incremental.refresh()
+
+    refit = engine_cls()
+    refit.add_documents(documents)
+
+    indices, scores = incremental.search_batch(queries, top_k=5)
+    expected_indices, expected_scores = refit.search_batch(queries, top_k=5)
+    assert np.array_equal(indices, expected_indices)
+    assert np.allclose(scores, expected_scores)
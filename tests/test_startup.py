@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+from semantic_search import SimpleSemanticSearch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("sklearn", "nltk", "pandas")
+# Generous, so a slow CI machine does not flake; a heavy import blows well past it.
+BUDGET_SECONDS = 5.0
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import semantic_search
+engine = semantic_search.SimpleSemanticSearch.load(sys.argv[1])
+engine.search("reset password")
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "heavy_modules": sorted(name for name in sys.modules if name.split(".")[0] in sys.argv[2:]),
+}))
+"""
+
+
+def test_load_and_first_query_skip_heavy_imports(tmp_path):
+    path = str(tmp_path / "index.ssidx")
+    engine = SimpleSemanticSearch()
+    engine.add_documents([f"How do I reset password number {i}?" for i in range(500)])
+    engine.save(path)
+    engine.close()
+
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT, path, *HEAVY_MODULES],
+        capture_output=True, text=True, check=True, cwd=ROOT
+    ).stdout
+    startup = json.loads(output)
+
+    assert startup["heavy_modules"] == []
+    assert startup["seconds"] < BUDGET_SECONDS
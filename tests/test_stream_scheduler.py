@@ -0,0 +1,36 @@
+import io
+import time
+
+from stream_scheduler import StreamScheduler
+
+
+def test_piece_by_piece_stream_keeps_pacing():
+    interval = 0.005
+    scheduler = StreamScheduler()
+    output = io.StringIO()
+    stream = scheduler.open_stream(output, interval)
+
+    start = time.monotonic()
+    # max_pending at the piece size makes every submit wait for the writer,
+    # so pieces always arrive at an idle stream.
+    for _ in range(20):
+        scheduler.submit(stream, ["word "], max_pending=5)
+    scheduler.wait_idle(stream)
+    elapsed = time.monotonic() - start
+
+    assert output.getvalue() == "word " * 20
+    # Each delay is interval * len(piece) * U(0.5, 1.5); 19 of them are waited on.
+    assert elapsed >= 0.4 * interval * len(output.getvalue())
+
+
+def test_unpaced_stream_is_not_delayed():
+    scheduler = StreamScheduler()
+    output = io.StringIO()
+    stream = scheduler.open_stream(output, 1.0, paced=False)
+
+    start = time.monotonic()
+    for _ in range(5):
+        scheduler.submit(stream, ["word "])
+        scheduler.wait_idle(stream)
+    assert time.monotonic() - start < 0.5
+    assert output.getvalue() == "word " * 5
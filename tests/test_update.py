@@ -0,0 +1,38 @@
+import pytest
+
+from inverted_index import InvertedIndexSearch
+from quantized_index import QuantizedSemanticSearch
+from semantic_search import SimpleSemanticSearch
+
+DOCUMENTS = [
+    "How do I reset my password?",
+    "Which payment methods do you accept?",
+    "How long does shipping take?",
+    "What is your refund policy?",
+]
+
+
+@pytest.mark.parametrize("engine_cls", [SimpleSemanticSearch, QuantizedSemanticSearch, InvertedIndexSearch])
+def test_update_makes_new_terms_searchable(engine_cls):
+    engine = engine_cls(compact_threshold=None)
+    engine.add_documents(DOCUMENTS)
+
+    engine.update(1, "We accept bitcoin payments")
+    results = engine.search("bitcoin", top_k=1)
+    assert [doc_id for doc_id, _, _ in results] == [1]
+    assert results[0][2] > 0
+    engine.close()
+
+
+@pytest.mark.parametrize("engine_cls", [SimpleSemanticSearch, QuantizedSemanticSearch, InvertedIndexSearch])
+def test_update_with_known_terms_does_not_refit(engine_cls, monkeypatch):
+    engine = engine_cls(compact_threshold=None)
+    engine.add_documents(DOCUMENTS)
+    refits = []
+    monkeypatch.setattr(engine, "_update_vectors", lambda: refits.append(True))
+
+    engine.update(2, "Refund policy for shipping")
+    assert refits == []
+    results = engine.search("refund shipping", top_k=2)
+    assert [doc_id for doc_id, _, _ in results] == [2, 3]
+    engine.close()
@@ -0,0 +1,121 @@
+import re
+from array import array
+
+import numpy as np
+from scipy import sparse
+
+# TfidfVectorizer's default token pattern: runs of two or more word characters.
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+# FNV-1a's 64-bit prime, used as the base of the rolling character n-gram hash.
+_NGRAM_BASE = 1099511628211
+
+
+def build_analyzer(stop_words):
+    """Tokenizer equivalent to `TfidfVectorizer(stop_words=..., lowercase=True).build_analyzer()`."""
+    stop_words = frozenset(stop_words or ())
+    findall = TOKEN_PATTERN.findall
+
+    def analyze(text):
+        return [token for token in findall(text.lower()) if token not in stop_words]
+
+    return analyze
+
+
+def count_terms(texts, analyzer, vocabulary):
+    """Term-count CSR matrix for `texts`, adding unseen terms to `vocabulary` in first-seen order.
+
+    Columns within a row are sorted; the matrix has `len(vocabulary)` columns
+    once all texts are counted.
+    """
+    indices = array('i')
+    indptr = array('q', [0])
+    for text in texts:
+        for term in analyzer(text):
+            column = vocabulary.get(term)
+            if column is None:
+                column = vocabulary[term] = len(vocabulary)
+            indices.append(column)
+        indptr.append(len(indices))
+
+    counts = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.float64), np.frombuffer(indices, dtype=np.int32), np.frombuffer(indptr, dtype=np.int64)),
+        shape=(len(indptr) - 1, len(vocabulary))
+    )
+    counts.sum_duplicates()
+    return counts
+
+
+def smoothed_idf(document_frequency, n_documents):
+    # Same smoothed IDF as TfidfVectorizer: ln((1 + n) / (1 + df)) + 1
+    return np.log((1 + n_documents) / (1 + document_frequency)) + 1
+
+
+def l2_normalize(matrix):
+    """Scale the rows of a CSR matrix to unit L2 norm in place, as `sklearn.preprocessing.normalize` does."""
+    row_lengths = np.diff(matrix.indptr)
+    # bincount sums each row left to right, the same order as sklearn's loop,
+    # so the norms (and hence the output) are bit-identical.
+    squares = np.bincount(
+        np.repeat(np.arange(matrix.shape[0]), row_lengths),
+        weights=matrix.data * matrix.data,
+        minlength=matrix.shape[0]
+    )
+    norms = np.sqrt(squares)
+    norms[norms == 0] = 1
+    matrix.data /= np.repeat(norms, row_lengths)
+    return matrix
+
+
+def transform(texts, analyzer, vocabulary, idf):
+    """L2-normalized TF-IDF rows for `texts` against a fitted vocabulary; terms outside it are ignored."""
+    indices = []
+    data = []
+    indptr = [0]
+    for text in texts:
+        counts = {}
+        for term in analyzer(text):
+            column = vocabulary.get(term)
+            if column is not None:
+                counts[column] = counts.get(column, 0) + 1
+        for column in sorted(counts):
+            indices.append(column)
+            data.append(counts[column])
+        indptr.append(len(indices))
+
+    indices = np.asarray(indices, dtype=np.int32)
+    matrix = sparse.csr_matrix(
+        (np.asarray(data, dtype=np.float64) * idf[indices], indices, indptr),
+        shape=(len(indptr) - 1, len(idf))
+    )
+    return l2_normalize(matrix)
+
+
+def normalize_text(text):
+    """Lowercased tokens of `text` joined by single spaces (punctuation and short tokens dropped)."""
+    return " ".join(TOKEN_PATTERN.findall(text.lower()))
+
+
+def char_ngram_hashes(texts, size):
+    """64-bit rolling hashes of every `size`-byte window of each text's `normalize_text` form.
+
+    Computed for all texts at once; windows that would cross into the next
+    text are skipped, and texts shorter than `size` are padded to one
+    window. Returns `(hashes, offsets)`: text `i` has
+    `hashes[offsets[i]:offsets[i + 1]]`.
+    """
+    encoded = [normalize_text(text).encode("utf-8").ljust(size) for text in texts]
+    lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+
+    n_windows = len(data) - size + 1
+    hashes = np.zeros(max(n_windows, 0), dtype=np.uint64)
+    for offset in range(size):
+        hashes = hashes * np.uint64(_NGRAM_BASE) + data[offset:offset + n_windows]
+
+    counts = lengths - size + 1
+    starts = np.cumsum(lengths) - lengths
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    positions = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+    return hashes[positions], offsets